@@ -6,8 +6,12 @@ import os
 import logging
 import json
 import asyncio
+from contextlib import asynccontextmanager
+import msgspec
 from dotenv import load_dotenv
 from fastmcp import MCPClient
+from src.api.http_client import close_mcp_httpx_client, get_mcp_httpx_client
+from src.api.mcp_messages import MCPMessage, MSGPACK_CONTENT_TYPE, JSON_CONTENT_TYPE
 
 # Configure logging
 logging.basicConfig(
@@ -16,32 +20,308 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Finance RPCs: method name -> (message type, payload argument names)
+_RPC_SPECS = {
+    "optimize_working_capital": ("finance.working_capital.optimize", ("scenario",)),
+    "optimize_accounts_payable": ("finance.accounts_payable.optimize", ("cash_position",)),
+    "optimize_accounts_receivable": ("finance.accounts_receivable.optimize", ("cash_position", "objective")),
+    "get_cash_flow_forecast": ("finance.cash_flow.forecast", ("days_horizon",))
+}
+
+class MCPError(Exception):
+    """Error returned by the MCP server for a failed request"""
+
+def _unwrap(response):
+    """Get the payload of a successful response
+    
+    Args:
+        response (dict): Response message
+        
+    Returns:
+        Response payload
+        
+    Raises:
+        MCPError: If the server reported an error
+    """
+    if response["status"] != "success":
+        raise MCPError(response.get("error"))
+    return response["payload"]
+
+class MCPSessionPool:
+    """
+    Pool of connected MCP client sessions keyed by (host, port) so repeated
+    tool calls reuse a warm session instead of reconnecting
+    """
+    
+    def __init__(self, max_sessions_per_url=10, session_ttl=300):
+        """Initialize the session pool
+        
+        Args:
+            max_sessions_per_url (int): Maximum open sessions per (host, port)
+            session_ttl (float): Seconds an idle session is kept before it is closed
+        """
+        self.max_sessions_per_url = max_sessions_per_url
+        self.session_ttl = session_ttl
+        self._idle = {}  # (host, port) -> queue of (client, last_used)
+        self._open = {}  # (host, port) -> number of open sessions
+        self._conditions = {}  # (host, port) -> condition signalled when a session is released or closed
+        self._reaper = None
+        
+    @asynccontextmanager
+    async def acquire(self, host, port):
+        """Acquire a connected session, creating one if none is idle
+        
+        Args:
+            host (str): MCP server host
+            port (int): MCP server port
+            
+        Yields:
+            MCPClient: Connected MCP client
+        """
+        client = await self._checkout(host, port)
+        succeeded = False
+        try:
+            yield client
+            succeeded = True
+        finally:
+            if succeeded:
+                await self.release(host, port, client)
+            else:
+                # The call failed or was cancelled, the session may be broken
+                # so don't hand it out again
+                await self._close(host, port, client)
+            
+    async def release(self, host, port, client):
+        """Return a session to the pool
+        
+        Args:
+            host (str): MCP server host
+            port (int): MCP server port
+            client (MCPClient): Session to return
+        """
+        loop = asyncio.get_running_loop()
+        condition = self._condition(host, port)
+        async with condition:
+            self._idle_queue(host, port).put_nowait((client, loop.time()))
+            condition.notify()
+        
+    async def close_all(self):
+        """Close all idle sessions and stop the reaper task"""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+            
+        # Snapshot the queues, checkouts for new hosts may add some while closing
+        for (host, port), idle in list(self._idle.items()):
+            while not idle.empty():
+                client, _ = idle.get_nowait()
+                await self._close(host, port, client)
+                
+        logger.info("Closed all pooled MCP sessions")
+        
+    def _idle_queue(self, host, port):
+        """Get the idle session queue for a (host, port)"""
+        return self._idle.setdefault((host, port), asyncio.Queue())
+        
+    def _condition(self, host, port):
+        """Get the condition guarding the sessions of a (host, port)"""
+        return self._conditions.setdefault((host, port), asyncio.Condition())
+        
+    async def _checkout(self, host, port):
+        """Take a live idle session or connect a new one"""
+        loop = asyncio.get_running_loop()
+        key = (host, port)
+        idle = self._idle_queue(host, port)
+        condition = self._condition(host, port)
+        client = None
+        expired = []
+        
+        async with condition:
+            while client is None:
+                if not idle.empty():
+                    idle_client, last_used = idle.get_nowait()
+                    if loop.time() - last_used < self.session_ttl:
+                        client = idle_client
+                    else:
+                        expired.append(idle_client)
+                        self._forget(host, port)
+                elif self._open.get(key, 0) < self.max_sessions_per_url:
+                    # Reserve a slot for a new session
+                    self._open[key] = self._open.get(key, 0) + 1
+                    break
+                else:
+                    # Pool is full, wait for a session to be released or closed
+                    await condition.wait()
+                
+        for stale in expired:
+            await self._disconnect(host, port, stale)
+            
+        if client is not None:
+            return client
+            
+        client = MCPClient(host=host, port=port, http_client=get_mcp_httpx_client())
+        try:
+            await client.connect()
+        except BaseException:
+            async with condition:
+                self._forget(host, port)
+            raise
+        logger.info("Opened MCP session to %s:%s", host, port)
+        
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_expired())
+            
+        return client
+        
+    def _forget(self, host, port):
+        """Free the slot of a closed session and wake one waiting checkout
+        
+        Must be called with the (host, port) condition held.
+        """
+        self._open[(host, port)] -= 1
+        self._condition(host, port).notify()
+        
+    async def _close(self, host, port, client):
+        """Disconnect a session and forget it"""
+        async with self._condition(host, port):
+            self._forget(host, port)
+        await self._disconnect(host, port, client)
+        
+    async def _disconnect(self, host, port, client):
+        """Disconnect a session, logging rather than raising errors"""
+        try:
+            await client.disconnect()
+        except Exception as e:
+            logger.warning("Error closing MCP session to %s:%s: %s", host, port, e)
+            
+    async def _reap_expired(self):
+        """Periodically close sessions that have been idle longer than the TTL"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.session_ttl / 2)
+            for (host, port), idle in list(self._idle.items()):
+                live = []
+                while not idle.empty():
+                    client, last_used = idle.get_nowait()
+                    if loop.time() - last_used < self.session_ttl:
+                        live.append((client, last_used))
+                    else:
+                        await self._close(host, port, client)
+                for item in live:
+                    idle.put_nowait(item)
+
+# Shared session pool for all integrations in this process
+session_pool = MCPSessionPool()
+
+async def shutdown():
+    """Close the shared session pool, its reaper task and the shared HTTP client
+    
+    Call once when the process is done with every integration.
+    """
+    await session_pool.close_all()
+    await close_mcp_httpx_client()
+
 class GoogleAgentMCPIntegration:
     """
     Integration class for connecting Finance MCP with Google Agent Dev Kit
     """
     
-    def __init__(self, mcp_host, mcp_port):
+    def __init__(self, mcp_host, mcp_port, pool=None):
         """Initialize the integration
         
         Args:
             mcp_host (str): MCP server host
             mcp_port (int): MCP server port
+            pool (MCPSessionPool, optional): Session pool, defaults to the shared pool
         """
         self.mcp_host = mcp_host
         self.mcp_port = mcp_port
-        self.mcp_client = MCPClient(host=mcp_host, port=mcp_port)
+        self.pool = pool if pool is not None else session_pool
+        self.content_type = MSGPACK_CONTENT_TYPE
+        self._enc = msgspec.msgpack.Encoder()
+        self._dec = msgspec.msgpack.Decoder()
         
     async def connect(self):
-        """Connect to the MCP server"""
-        await self.mcp_client.connect()
-        logger.info(f"Connected to MCP server at {self.mcp_host}:{self.mcp_port}")
+        """Connect to the MCP server and negotiate the payload content type"""
+        response = await self._send_message({
+            "type": "mcp.negotiate",
+            "content_type": MSGPACK_CONTENT_TYPE
+        })
+        logger.info("Connected to MCP server at %s:%s", self.mcp_host, self.mcp_port)
+        
+        if response.get("status") == "success":
+            self.content_type = MSGPACK_CONTENT_TYPE
+        else:
+            # Older servers only understand JSON payloads
+            logger.warning("MCP server rejected %s, falling back to JSON", MSGPACK_CONTENT_TYPE)
+            self.content_type = JSON_CONTENT_TYPE
+        logger.info("Using %s payloads", self.content_type)
         
     async def disconnect(self):
-        """Disconnect from the MCP server"""
-        await self.mcp_client.disconnect()
+        """Disconnect from the MCP server
+        
+        Deliberately leaves the pool open: its sessions stay available to other
+        integrations sharing it. The pool is closed by its owner, for the
+        shared pool that is shutdown() at process exit.
+        """
         logger.info("Disconnected from MCP server")
         
+    async def _send_message(self, message):
+        """Send a message over a pooled MCP session
+        
+        Args:
+            message (MCPMessage or dict): MCP message
+            
+        Returns:
+            dict: Response message
+        """
+        if isinstance(message, MCPMessage):
+            # Handlers route on the envelope fields, only the payload is encoded
+            message = msgspec.structs.asdict(message)
+                
+        async with self.pool.acquire(self.mcp_host, self.mcp_port) as client:
+            return await client.send_message(message)
+        
+    def _encode(self, payload):
+        """Encode a message payload using the negotiated content type"""
+        if self.content_type == MSGPACK_CONTENT_TYPE:
+            return self._enc.encode(payload)
+        return json.dumps(payload).encode()
+        
+    def _decode(self, payload):
+        """Decode a response payload using the negotiated content type"""
+        if self.content_type == MSGPACK_CONTENT_TYPE:
+            return self._dec.decode(payload)
+        return json.loads(payload)
+        
+    async def call(self, name, **kw):
+        """Call a finance RPC by method name
+        
+        Args:
+            name (str): RPC method name, a key of _RPC_SPECS
+            **kw: Payload arguments of the RPC
+            
+        Returns:
+            Decoded response payload
+            
+        Raises:
+            TypeError: If the arguments don't match the RPC
+            MCPError: If the server reported an error
+        """
+        message_type, arg_names = _RPC_SPECS[name]
+        if kw.keys() != set(arg_names):
+            raise TypeError(f"{name}() takes arguments {arg_names}, got {tuple(kw)}")
+            
+        logger.info("Calling %s with %s", message_type, kw)
+        
+        message = MCPMessage(
+            type=message_type,
+            payload=self._encode(kw),
+            content_type=self.content_type
+        )
+        
+        return self._decode(_unwrap(await self._send_message(message)))
+        
     async def optimize_working_capital(self, scenario="base"):
         """Optimize working capital
         
@@ -50,21 +330,11 @@ class GoogleAgentMCPIntegration:
             
         Returns:
             dict: Optimization result
+            
+        Raises:
+            MCPError: If the server reported an error
         """
-        logger.info(f"Optimizing working capital with scenario: {scenario}")
-        
-        message = {
-            "type": "finance.working_capital.optimize",
-            "payload": json.dumps({"scenario": scenario})
-        }
-        
-        response = await self.mcp_client.send_message(message)
-        
-        if response.get("status") == "success":
-            return json.loads(response.get("payload", "{}"))
-        else:
-            logger.error(f"Error optimizing working capital: {response.get('error')}")
-            return {"error": response.get("error")}
+        return await self.call("optimize_working_capital", scenario=scenario)
             
     async def optimize_accounts_payable(self, cash_position):
         """Optimize accounts payable
@@ -74,21 +344,11 @@ class GoogleAgentMCPIntegration:
             
         Returns:
             dict: Optimization result
+            
+        Raises:
+            MCPError: If the server reported an error
         """
-        logger.info(f"Optimizing accounts payable with cash position: {cash_position}")
-        
-        message = {
-            "type": "finance.accounts_payable.optimize",
-            "payload": json.dumps({"cash_position": cash_position})
-        }
-        
-        response = await self.mcp_client.send_message(message)
-        
-        if response.get("status") == "success":
-            return json.loads(response.get("payload", "{}"))
-        else:
-            logger.error(f"Error optimizing accounts payable: {response.get('error')}")
-            return {"error": response.get("error")}
+        return await self.call("optimize_accounts_payable", cash_position=cash_position)
             
     async def optimize_accounts_receivable(self, cash_position, objective="balanced"):
         """Optimize accounts receivable
@@ -99,24 +359,11 @@ class GoogleAgentMCPIntegration:
             
         Returns:
             dict: Optimization result
+            
+        Raises:
+            MCPError: If the server reported an error
         """
-        logger.info(f"Optimizing accounts receivable with cash position: {cash_position} and objective: {objective}")
-        
-        message = {
-            "type": "finance.accounts_receivable.optimize",
-            "payload": json.dumps({
-                "cash_position": cash_position,
-                "objective": objective
-            })
-        }
-        
-        response = await self.mcp_client.send_message(message)
-        
-        if response.get("status") == "success":
-            return json.loads(response.get("payload", "{}"))
-        else:
-            logger.error(f"Error optimizing accounts receivable: {response.get('error')}")
-            return {"error": response.get("error")}
+        return await self.call("optimize_accounts_receivable", cash_position=cash_position, objective=objective)
             
     async def get_cash_flow_forecast(self, days_horizon=90):
         """Get cash flow forecast
@@ -125,22 +372,39 @@ class GoogleAgentMCPIntegration:
             days_horizon (int): Number of days to forecast
             
         Returns:
-            list: Cash flow forecast
+            dict: Cash flow forecast as date, inflow and outflow columns
+            
+        Raises:
+            MCPError: If the server reported an error
         """
-        logger.info(f"Getting cash flow forecast for {days_horizon} days")
+        return await self.call("get_cash_flow_forecast", days_horizon=days_horizon)
+            
+    async def batch(self, ops):
+        """Send several finance operations in a single message
         
-        message = {
-            "type": "finance.cash_flow.forecast",
-            "payload": json.dumps({"days_horizon": days_horizon})
-        }
+        Args:
+            ops (list): Operations, each a dict with a message "type" and a "payload" dict
+            
+        Returns:
+            list: Result of each operation in order, an MCPError for failed operations
+            
+        Raises:
+            MCPError: If the server rejected the whole batch
+        """
+        logger.info("Sending batch of %s operations", len(ops))
         
-        response = await self.mcp_client.send_message(message)
+        message = MCPMessage(
+            type="batch",
+            payload=self._encode({"ops": ops}),
+            content_type=self.content_type
+        )
         
-        if response.get("status") == "success":
-            return json.loads(response.get("payload", "{}"))
-        else:
-            logger.error(f"Error getting cash flow forecast: {response.get('error')}")
-            return {"error": response.get("error")}
+        results = self._decode(_unwrap(await self._send_message(message)))
+        
+        return [
+            result["payload"] if result["status"] == "success" else MCPError(result.get("error"))
+            for result in results
+        ]
             
     async def execute_neo4j_query(self, query, parameters=None):
         """Execute a Neo4j Cypher query
@@ -151,12 +415,16 @@ class GoogleAgentMCPIntegration:
             
         Returns:
             list: Query results
+            
+        Raises:
+            MCPError: If the server reported an error
         """
         if parameters is None:
             parameters = {}
             
-        logger.info(f"Executing Neo4j query: {query}")
+        logger.info("Executing Neo4j query: %s", query)
         
+        # The Neo4j Cypher handler only understands JSON payloads
         message = {
             "type": "neo4j.cypher",
             "payload": json.dumps({
@@ -165,13 +433,7 @@ class GoogleAgentMCPIntegration:
             })
         }
         
-        response = await self.mcp_client.send_message(message)
-        
-        if response.get("status") == "success":
-            return json.loads(response.get("payload", "{}"))
-        else:
-            logger.error(f"Error executing Neo4j query: {response.get('error')}")
-            return {"error": response.get("error")}
+        return json.loads(_unwrap(await self._send_message(message)))
 
 async def demo():
     """Run a demonstration of the Google Agent integration"""
@@ -189,42 +451,71 @@ async def demo():
         # Connect to MCP server
         await integration.connect()
         
-        # Get cash flow forecast
-        logger.info("Getting cash flow forecast...")
-        forecast = await integration.get_cash_flow_forecast()
-        logger.info(f"Received forecast with {len(forecast)} days")
-        
-        # Optimize working capital
-        logger.info("Optimizing working capital...")
-        wc_result = await integration.optimize_working_capital(scenario="base")
-        logger.info(f"Working capital optimization complete. Metrics: {wc_result.get('metrics', {})}")
-        
-        # Optimize accounts payable
-        logger.info("Optimizing accounts payable...")
-        ap_result = await integration.optimize_accounts_payable(cash_position=500000)
-        logger.info(f"Accounts payable optimization complete. Metrics: {ap_result.get('metrics', {})}")
-        
-        # Optimize accounts receivable
-        logger.info("Optimizing accounts receivable...")
-        ar_result = await integration.optimize_accounts_receivable(
-            cash_position=500000,
-            objective="balanced"
+        # Send the forecast and optimizations as one batch, concurrently with
+        # the Neo4j query which is served by a separate handler
+        logger.info("Running cash flow forecast, optimizations and Neo4j query...")
+        batch_results, query_result = await asyncio.gather(
+            integration.batch([
+                {"type": "finance.cash_flow.forecast", "payload": {"days_horizon": 90}},
+                {"type": "finance.working_capital.optimize", "payload": {"scenario": "base"}},
+                {"type": "finance.accounts_payable.optimize", "payload": {"cash_position": 500000}},
+                {
+                    "type": "finance.accounts_receivable.optimize",
+                    "payload": {"cash_position": 500000, "objective": "balanced"}
+                }
+            ]),
+            integration.execute_neo4j_query(
+                "MATCH (c:Customer) RETURN c.id AS id, c.name AS name LIMIT 5"
+            ),
+            return_exceptions=True
         )
-        logger.info(f"Accounts receivable optimization complete. Metrics: {ar_result.get('metrics', {})}")
         
-        # Execute a Neo4j query
-        logger.info("Executing Neo4j query...")
-        query_result = await integration.execute_neo4j_query(
-            "MATCH (c:Customer) RETURN c.id AS id, c.name AS name LIMIT 5"
-        )
-        logger.info(f"Query result: {query_result}")
+        if isinstance(batch_results, Exception):
+            forecast = wc_result = ap_result = ar_result = batch_results
+        else:
+            forecast, wc_result, ap_result, ar_result = batch_results
+        
+        if isinstance(forecast, Exception):
+            logger.error("Error getting cash flow forecast: %s", forecast)
+        else:
+            logger.info("Received forecast with %s days", len(forecast["date"]))
+        
+        if isinstance(wc_result, Exception):
+            logger.error("Error optimizing working capital: %s", wc_result)
+        else:
+            logger.info("Working capital optimization complete. Metrics: %s", wc_result.get('metrics', {}))
+        
+        if isinstance(ap_result, Exception):
+            logger.error("Error optimizing accounts payable: %s", ap_result)
+        else:
+            logger.info("Accounts payable optimization complete. Metrics: %s", ap_result.get('metrics', {}))
+        
+        if isinstance(ar_result, Exception):
+            logger.error("Error optimizing accounts receivable: %s", ar_result)
+        else:
+            logger.info("Accounts receivable optimization complete. Metrics: %s", ar_result.get('metrics', {}))
+        
+        if isinstance(query_result, Exception):
+            logger.error("Error executing Neo4j query: %s", query_result)
+        elif logger.isEnabledFor(logging.DEBUG):
+            # Rows can be large, only format them when debugging
+            logger.debug("Query result: %s", query_result)
         
     except Exception as e:
-        logger.error(f"Error in demo: {e}")
+        logger.error("Error in demo: %s", e)
     finally:
-        # Disconnect from MCP server
+        # Disconnect from MCP server, then release the pooled sessions, the
+        # reaper task and the HTTP client before exiting
         await integration.disconnect()
+        await shutdown()
 
 if __name__ == "__main__":
+    # Use the libuv-based event loop where available
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        logger.info("uvloop not installed, using the default asyncio event loop")
+    
     # Run the demo
     asyncio.run(demo())
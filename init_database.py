@@ -31,7 +31,9 @@ def main():
     neo4j_client = Neo4jClient(
         uri=os.getenv("NEO4J_URI", "bolt://localhost:7687"),
         user=os.getenv("NEO4J_USER", "neo4j"),
-        password=os.getenv("NEO4J_PASSWORD", "password")
+        password=os.getenv("NEO4J_PASSWORD", "password"),
+        max_connection_pool_size=int(os.getenv("NEO4J_POOL") or "50"),
+        connection_acquisition_timeout=30
     )
     
     try:
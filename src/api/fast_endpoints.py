@@ -3,23 +3,31 @@ FastAPI Endpoints for Finance MCP Application
 Provides HTTP endpoints for interacting with the financial models
 """
 import logging
-from fastapi import APIRouter, Depends, HTTPException, Query, Path, Body
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field, validator
-from typing import List, Dict, Any, Optional, Union
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Query, Path, Body, Request
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import TYPE_CHECKING, List, Dict, Any, Literal, Optional, Union
 from datetime import date, datetime
 from enum import Enum
+import msgspec
 
-# Import database and models
+# Import database components
 from database.neo4j_client import Neo4jClient
-from models.working_capital import WorkingCapitalOptimizer
-from models.accounts_payable import AccountsPayableOptimizer
-from models.accounts_receivable import AccountsReceivableOptimizer
+
+# Import models for type hints only, the optimizers are created at startup
+if TYPE_CHECKING:
+    from models.working_capital import WorkingCapitalOptimizer
+    from models.accounts_payable import AccountsPayableOptimizer
+    from models.accounts_receivable import AccountsReceivableOptimizer
 
 logger = logging.getLogger(__name__)
 
 # Create API router
-router = APIRouter(tags=["Finance API"])
+router = APIRouter(tags=["Finance API"], default_response_class=ORJSONResponse)
+
+# Encoder for streamed responses
+_json_encoder = msgspec.json.Encoder()
 
 # Enums for validation
 class InvoiceType(str, Enum):
@@ -36,38 +44,33 @@ class OptimizationObjective(str, Enum):
     RELATIONSHIP = "relationship"
     BALANCED = "balanced"
 
+def _enum_member(enum_cls, v):
+    """Look up an enum member by value with a dict lookup, leaving unknown values for Pydantic to reject"""
+    if isinstance(v, str):
+        return enum_cls._value2member_map_.get(v, v)
+    return v
+
 # Pydantic models for request/response
 class InvoiceCreate(BaseModel):
     """Model for creating a new invoice"""
     amount: float = Field(..., gt=0, description="Invoice amount (must be positive)")
-    dueDate: str = Field(..., description="Due date in YYYY-MM-DD format")
-    issueDate: str = Field(..., description="Issue date in YYYY-MM-DD format")
+    dueDate: date = Field(..., description="Due date in YYYY-MM-DD format")
+    issueDate: date = Field(..., description="Issue date in YYYY-MM-DD format")
     type: InvoiceType = Field(..., description="Invoice type - 'AR' or 'AP'")
     entityId: str = Field(..., description="ID of customer (AR) or supplier (AP)")
-    earlyPaymentDate: Optional[str] = Field(None, description="Early payment date for discount")
+    earlyPaymentDate: Optional[date] = Field(None, description="Early payment date for discount")
     discountRate: Optional[float] = Field(None, ge=0, le=1, description="Discount rate for early payment (0-1)")
 
-    @validator('dueDate', 'issueDate', 'earlyPaymentDate')
-    def validate_date_format(cls, v):
-        if v is None:
-            return v
-        try:
-            datetime.strptime(v, '%Y-%m-%d')
-            return v
-        except ValueError:
-            raise ValueError('Date must be in YYYY-MM-DD format')
-
-    @validator('earlyPaymentDate')
-    def validate_early_payment_date(cls, v, values):
-        if v is None:
-            return v
-        if 'issueDate' in values and 'dueDate' in values:
-            issue_date = datetime.strptime(values['issueDate'], '%Y-%m-%d')
-            due_date = datetime.strptime(values['dueDate'], '%Y-%m-%d')
-            early_date = datetime.strptime(v, '%Y-%m-%d')
-            if early_date < issue_date or early_date > due_date:
-                raise ValueError('Early payment date must be between issue date and due date')
-        return v
+    @field_validator('type', mode='before')
+    @classmethod
+    def coerce_type(cls, v):
+        return _enum_member(InvoiceType, v)
+
+    @model_validator(mode='after')
+    def validate_early_payment_date(self):
+        if self.earlyPaymentDate is not None and not (self.issueDate <= self.earlyPaymentDate <= self.dueDate):
+            raise ValueError('Early payment date must be between issue date and due date')
+        return self
 
 class OptimizationRequest(BaseModel):
     """Model for optimization request"""
@@ -75,6 +78,16 @@ class OptimizationRequest(BaseModel):
     scenario: OptimizationScenario = Field(OptimizationScenario.BASE, description="Optimization scenario")
     objective: OptimizationObjective = Field(OptimizationObjective.BALANCED, description="Optimization objective")
 
+    @field_validator('scenario', mode='before')
+    @classmethod
+    def coerce_scenario(cls, v):
+        return _enum_member(OptimizationScenario, v)
+
+    @field_validator('objective', mode='before')
+    @classmethod
+    def coerce_objective(cls, v):
+        return _enum_member(OptimizationObjective, v)
+
 class ObjectiveWeights(BaseModel):
     """Model for objective weights"""
     liquidity: float = Field(..., ge=0, le=1, description="Weight for liquidity objective")
@@ -82,14 +95,13 @@ class ObjectiveWeights(BaseModel):
     transaction_cost: float = Field(..., ge=0, le=1, description="Weight for transaction cost objective")
     relationship: float = Field(..., ge=0, le=1, description="Weight for relationship objective")
 
-    @validator('liquidity', 'financing_cost', 'transaction_cost', 'relationship')
-    def validate_weights_sum(cls, v, values):
+    @model_validator(mode='after')
+    def validate_weights_sum(self):
         # Ensure weights sum to approximately 1
-        if len(values) == 3:  # This is the last field being validated
-            total = v + sum(values.values())
-            if not 0.99 <= total <= 1.01:
-                raise ValueError('Weights must sum to approximately 1.0')
-        return v
+        total = self.liquidity + self.financing_cost + self.transaction_cost + self.relationship
+        if not 0.99 <= total <= 1.01:
+            raise ValueError('Weights must sum to approximately 1.0')
+        return self
 
 class ApiResponse(BaseModel):
     """Base API response model"""
@@ -98,26 +110,39 @@ class ApiResponse(BaseModel):
     message: Optional[str] = None
 
 # Dependency to get Neo4j client
-def get_neo4j_client():
+def get_neo4j_client(request: Request):
     """Get Neo4j client dependency"""
-    from main import neo4j_client
-    return neo4j_client
+    return request.app.state.neo4j_client
 
 # Dependency to get optimizers
-def get_working_capital_optimizer():
+def get_working_capital_optimizer(request: Request):
     """Get working capital optimizer dependency"""
-    from main import working_capital_optimizer
-    return working_capital_optimizer
+    return request.app.state.working_capital_optimizer
 
-def get_accounts_payable_optimizer():
+def get_accounts_payable_optimizer(request: Request):
     """Get accounts payable optimizer dependency"""
-    from main import accounts_payable_optimizer
-    return accounts_payable_optimizer
+    return request.app.state.accounts_payable_optimizer
 
-def get_accounts_receivable_optimizer():
+def get_accounts_receivable_optimizer(request: Request):
     """Get accounts receivable optimizer dependency"""
-    from main import accounts_receivable_optimizer
-    return accounts_receivable_optimizer
+    return request.app.state.accounts_receivable_optimizer
+
+async def _stream_api_response(rows, message):
+    """Stream a successful ApiResponse whose data is a list, one row at a time
+
+    Args:
+        rows (iterable): Rows for the data field
+        message (str): Response message
+
+    Yields:
+        bytes: Chunks of the JSON document
+    """
+    yield b'{"status":"success","data":['
+    first = True
+    for row in rows:
+        yield (b'' if first else b',') + _json_encoder.encode(row)
+        first = False
+    yield b'],"message":' + _json_encoder.encode(message) + b'}'
 
 # API Endpoints
 
@@ -137,7 +162,9 @@ async def create_invoice(
     - **discountRate**: Optional discount rate for early payment (0-1)
     """
     try:
-        result = neo4j_client.create_invoice(invoice.dict())
+        # Dump dates back to YYYY-MM-DD strings, which is how invoices are stored
+        invoice_data = invoice.model_dump(mode='json')
+        result = neo4j_client.create_invoice(invoice_data)
         if not result:
             raise HTTPException(status_code=400, detail="Failed to create invoice")
         return ApiResponse(status="success", data=result, message="Invoice created successfully")
@@ -145,43 +172,48 @@ async def create_invoice(
         logger.error(f"Error creating invoice: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/invoices/{invoice_type}", response_model=ApiResponse, summary="Get invoices by type")
+@router.get("/invoices/{invoice_type}", response_model=ApiResponse, response_class=ORJSONResponse, summary="Get invoices by type")
 async def get_invoices(
-    invoice_type: InvoiceType = Path(..., description="Invoice type - AR or AP"),
-    days_horizon: int = Query(90, ge=1, le=365, description="Number of days to look ahead")
+    invoice_type: Literal["AR", "AP"] = Path(..., description="Invoice type - AR or AP"),
+    days_horizon: int = Query(90, ge=1, le=365, description="Number of days to look ahead"),
+    neo4j_client: Neo4jClient = Depends(get_neo4j_client)
 ):
     """Get invoices by type (AR or AP) within a time horizon
 
     - **invoice_type**: Type of invoices to retrieve (AR or AP)
     - **days_horizon**: Number of days to look ahead (1-365)
     """
-    neo4j_client = get_neo4j_client()
     try:
         invoices = neo4j_client.get_invoices_by_type(invoice_type, days_horizon)
-        return ApiResponse(
-            status="success", 
-            data=invoices, 
-            message=f"Retrieved {len(invoices)} {invoice_type} invoices"
-        )
+        # Large payload, serialize directly instead of validating through ApiResponse
+        return ORJSONResponse({
+            "status": "success",
+            "data": invoices,
+            "message": f"Retrieved {len(invoices)} {invoice_type} invoices"
+        })
     except Exception as e:
         logger.error(f"Error getting invoices: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/cash-flow", response_model=ApiResponse, summary="Get cash flow forecast")
+@router.get("/cash-flow", response_model=ApiResponse, response_class=StreamingResponse, summary="Get cash flow forecast")
 async def get_cash_flow(
-    days_horizon: int = Query(90, ge=1, le=365, description="Number of days to forecast")
+    days_horizon: int = Query(90, ge=1, le=365, description="Number of days to forecast"),
+    neo4j_client: Neo4jClient = Depends(get_neo4j_client)
 ):
     """Get cash flow forecast for the specified horizon
 
     - **days_horizon**: Number of days to forecast (1-365)
     """
-    neo4j_client = get_neo4j_client()
     try:
         forecast = neo4j_client.get_cash_flow_forecast(days_horizon)
-        return ApiResponse(
-            status="success", 
-            data=forecast, 
-            message=f"Cash flow forecast for {days_horizon} days"
+        rows = (
+            {"date": day, "inflow": inflow, "outflow": outflow}
+            for day, inflow, outflow in zip(forecast["date"], forecast["inflow"], forecast["outflow"])
+        )
+        # Stream rows as they are encoded instead of building the whole body
+        return StreamingResponse(
+            _stream_api_response(rows, f"Cash flow forecast for {days_horizon} days"),
+            media_type="application/json"
         )
     except Exception as e:
         logger.error(f"Error getting cash flow forecast: {e}")
@@ -190,7 +222,7 @@ async def get_cash_flow(
 @router.post("/optimize/working-capital", response_model=ApiResponse, summary="Optimize working capital")
 async def optimize_working_capital(
     request: OptimizationRequest,
-    optimizer: WorkingCapitalOptimizer = Depends(get_working_capital_optimizer)
+    optimizer: "WorkingCapitalOptimizer" = Depends(get_working_capital_optimizer)
 ):
     """Optimize working capital management
 
@@ -199,7 +231,8 @@ async def optimize_working_capital(
     - **objective**: Optimization objective (cash_flow, relationship, balanced)
     """
     try:
-        result = optimizer.optimize(scenario=request.scenario)
+        # Run the solver off the event loop so other requests are still served
+        result = await asyncio.to_thread(optimizer.optimize, scenario=request.scenario)
         return ApiResponse(
             status="success", 
             data=result, 
@@ -212,7 +245,7 @@ async def optimize_working_capital(
 @router.post("/optimize/accounts-payable", response_model=ApiResponse, summary="Optimize accounts payable")
 async def optimize_accounts_payable(
     request: OptimizationRequest,
-    optimizer: AccountsPayableOptimizer = Depends(get_accounts_payable_optimizer)
+    optimizer: "AccountsPayableOptimizer" = Depends(get_accounts_payable_optimizer)
 ):
     """Optimize accounts payable payment schedule
 
@@ -220,7 +253,10 @@ async def optimize_accounts_payable(
     - **scenario**: Optimization scenario (base, conservative, aggressive)
     """
     try:
-        result = optimizer.optimize_payment_schedule(cash_position=request.cashPosition)
+        result = await asyncio.to_thread(
+            optimizer.optimize_payment_schedule,
+            cash_position=request.cashPosition
+        )
         return ApiResponse(
             status="success", 
             data=result, 
@@ -233,7 +269,7 @@ async def optimize_accounts_payable(
 @router.post("/optimize/accounts-receivable", response_model=ApiResponse, summary="Optimize accounts receivable")
 async def optimize_accounts_receivable(
     request: OptimizationRequest,
-    optimizer: AccountsReceivableOptimizer = Depends(get_accounts_receivable_optimizer)
+    optimizer: "AccountsReceivableOptimizer" = Depends(get_accounts_receivable_optimizer)
 ):
     """Optimize accounts receivable collection strategy
 
@@ -241,7 +277,8 @@ async def optimize_accounts_receivable(
     - **objective**: Optimization objective (cash_flow, relationship, balanced)
     """
     try:
-        result = optimizer.optimize_collection_strategy(
+        result = await asyncio.to_thread(
+            optimizer.optimize_collection_strategy,
             cash_position=request.cashPosition,
             objective=request.objective
         )
@@ -258,7 +295,7 @@ async def optimize_accounts_receivable(
 async def set_supplier_importance(
     supplier_id: str = Path(..., description="Supplier ID"),
     importance_score: float = Query(..., ge=0, le=1, description="Importance score (0-1)"),
-    optimizer: AccountsPayableOptimizer = Depends(get_accounts_payable_optimizer)
+    optimizer: "AccountsPayableOptimizer" = Depends(get_accounts_payable_optimizer)
 ):
     """Set the importance score for a supplier
 
@@ -280,7 +317,7 @@ async def set_supplier_importance(
 async def set_customer_importance(
     customer_id: str = Path(..., description="Customer ID"),
     importance_score: float = Query(..., ge=0, le=1, description="Importance score (0-1)"),
-    optimizer: AccountsReceivableOptimizer = Depends(get_accounts_receivable_optimizer)
+    optimizer: "AccountsReceivableOptimizer" = Depends(get_accounts_receivable_optimizer)
 ):
     """Set the importance score for a customer
 
@@ -301,7 +338,7 @@ async def set_customer_importance(
 @router.post("/working-capital/objective-weights", response_model=ApiResponse, summary="Set objective weights")
 async def set_objective_weights(
     weights: ObjectiveWeights,
-    optimizer: WorkingCapitalOptimizer = Depends(get_working_capital_optimizer)
+    optimizer: "WorkingCapitalOptimizer" = Depends(get_working_capital_optimizer)
 ):
     """Set the weights for the multi-objective optimization
 
@@ -313,10 +350,11 @@ async def set_objective_weights(
     Note: Weights should sum to approximately 1.0
     """
     try:
-        optimizer.set_objective_weights(weights.dict())
+        weights_data = weights.model_dump()
+        optimizer.set_objective_weights(weights_data)
         return ApiResponse(
             status="success", 
-            data=weights.dict(), 
+            data=weights_data, 
             message="Objective weights set successfully"
         )
     except Exception as e:
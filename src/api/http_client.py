@@ -0,0 +1,71 @@
+"""
+HTTP Client for Finance MCP Application
+Provides the shared httpx client used by MCP client transports
+"""
+import os
+import logging
+from functools import lru_cache
+import httpx
+
+logger = logging.getLogger(__name__)
+
+def _positive_setting(name, default, cast=int):
+    """Read a positive numeric setting from the environment
+
+    Args:
+        name (str): Environment variable name
+        default (str): Default value when the variable is unset or empty
+        cast (type): Type to convert the value to
+
+    Returns:
+        int or float: Validated setting value
+    """
+    value = cast(os.getenv(name) or default)
+    if value <= 0:
+        raise ValueError(f"{name} must be positive, got {value}")
+    return value
+
+def get_mcp_client_settings():
+    """Get the connection pool settings for the MCP HTTP client
+
+    Returns:
+        dict: Validated connection pool settings
+    """
+    settings = {
+        'mcp_client_max_connections': _positive_setting("MCP_CLIENT_MAX_CONNECTIONS", "500"),
+        'mcp_client_max_keepalive_connections': _positive_setting("MCP_CLIENT_MAX_KEEPALIVE_CONNECTIONS", "100"),
+        'mcp_client_keepalive_expiry': _positive_setting("MCP_CLIENT_KEEPALIVE_EXPIRY", "30", float)
+    }
+
+    if settings['mcp_client_max_keepalive_connections'] > settings['mcp_client_max_connections']:
+        raise ValueError("MCP_CLIENT_MAX_KEEPALIVE_CONNECTIONS cannot exceed MCP_CLIENT_MAX_CONNECTIONS")
+
+    return settings
+
+@lru_cache(maxsize=1)
+def get_mcp_httpx_client():
+    """Get the shared httpx client for MCP transports
+
+    Returns:
+        httpx.AsyncClient: Client with explicit connection pool limits
+    """
+    settings = get_mcp_client_settings()
+    limits = httpx.Limits(
+        max_connections=settings['mcp_client_max_connections'],
+        max_keepalive_connections=settings['mcp_client_max_keepalive_connections'],
+        keepalive_expiry=settings['mcp_client_keepalive_expiry']
+    )
+    logger.info("Creating MCP HTTP client with limits %s", limits)
+    return httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(30.0, connect=5.0))
+
+async def close_mcp_httpx_client():
+    """Close the shared httpx client for MCP transports, if it was created
+
+    The next get_mcp_httpx_client() call creates a new client.
+    """
+    if get_mcp_httpx_client.cache_info().currsize == 0:
+        return
+
+    await get_mcp_httpx_client().aclose()
+    get_mcp_httpx_client.cache_clear()
+    logger.info("Closed MCP HTTP client")
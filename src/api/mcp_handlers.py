@@ -3,22 +3,112 @@ MCP Handlers for Finance MCP Application
 Implements handlers for the FastMCP server
 """
 import logging
-import json
+import asyncio
+from typing import TYPE_CHECKING, Annotated, Dict, List, Literal
+from functools import partial, wraps
+import msgspec
+import orjson
 from fastmcp.router import MCPRouter
 from mcp_neo4j_cypher import Neo4jCypherHandler
 
-# Import models
-from models.working_capital import WorkingCapitalOptimizer
-from models.accounts_payable import AccountsPayableOptimizer
-from models.accounts_receivable import AccountsReceivableOptimizer
+# Import message types
+from api.mcp_messages import MSGPACK_CONTENT_TYPE, JSON_CONTENT_TYPE, SUPPORTED_CONTENT_TYPES
+
+# Import database components
+from database.write_batcher import InvoiceWriteBatcher
+
+# Import models for type hints only, the optimizers are created at startup
+if TYPE_CHECKING:
+    from models.working_capital import WorkingCapitalOptimizer
+    from models.accounts_payable import AccountsPayableOptimizer
+    from models.accounts_receivable import AccountsReceivableOptimizer
 
 logger = logging.getLogger(__name__)
 
+def _msgpack_enc_hook(obj):
+    """Convert numpy scalars and date values that msgpack cannot encode natively"""
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    if hasattr(obj, "item"):
+        return obj.item()
+    raise NotImplementedError(f"Objects of type {type(obj)} are not supported")
+
+_msgpack_encoder = msgspec.msgpack.Encoder(enc_hook=_msgpack_enc_hook)
+
+# Serialize datetimes and numpy values in JSON payloads without a custom encoder
+_JSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY
+_dumps = orjson.dumps
+
+class _ErrorResponse(dict):
+    """Error response message, returned by handlers as-is instead of as a payload"""
+
+# Error responses for static errors, built once and shared by every request
+_ERR_CREATE_INVOICE = _ErrorResponse(status="error", error="Failed to create invoice")
+
+def _err(error):
+    """Build an error response
+    
+    Args:
+        error: Error message or exception
+        
+    Returns:
+        dict: Error response message
+    """
+    return _ErrorResponse(status="error", error=str(error))
+
+# Request payload schemas, decoded and validated in one pass
+NonEmptyStr = Annotated[str, msgspec.Meta(min_length=1)]
+
+class BatchRequest(msgspec.Struct):
+    """Payload of a batch message"""
+    ops: List[dict] = []
+
+class WorkingCapitalOptimizeRequest(msgspec.Struct):
+    """Payload of a working capital optimization request"""
+    scenario: str = "base"
+
+class ObjectiveWeightsRequest(msgspec.Struct):
+    """Payload for setting objective weights"""
+    weights: Dict[str, float] = {}
+
+class AccountsPayableOptimizeRequest(msgspec.Struct):
+    """Payload of an accounts payable optimization request"""
+    cash_position: float = 0
+
+class SupplierImportanceRequest(msgspec.Struct):
+    """Payload for setting supplier importance"""
+    supplier_id: NonEmptyStr
+    importance_score: float
+
+class AccountsReceivableOptimizeRequest(msgspec.Struct):
+    """Payload of an accounts receivable optimization request"""
+    cash_position: float = 0
+    objective: str = "balanced"
+
+class CustomerImportanceRequest(msgspec.Struct):
+    """Payload for setting customer importance"""
+    customer_id: NonEmptyStr
+    importance_score: float
+
+class InvoicesByTypeRequest(msgspec.Struct):
+    """Payload for getting invoices by type"""
+    type: Literal["AR", "AP"]
+    days_horizon: int = 90
+
+class CashFlowForecastRequest(msgspec.Struct):
+    """Payload of a cash flow forecast request"""
+    days_horizon: int = 90
+
+# Operations inside a batch carry already decoded payloads and return raw
+# results, the batch envelope is decoded and encoded once as a whole
+_NATIVE_CONTENT_TYPE = "application/x-python-object"
+
 def register_mcp_handlers(
     mcp_router: MCPRouter,
-    working_capital_optimizer: WorkingCapitalOptimizer,
-    accounts_payable_optimizer: AccountsPayableOptimizer,
-    accounts_receivable_optimizer: AccountsReceivableOptimizer
+    working_capital_optimizer: "WorkingCapitalOptimizer",
+    accounts_payable_optimizer: "AccountsPayableOptimizer",
+    accounts_receivable_optimizer: "AccountsReceivableOptimizer",
+    invoice_batcher: InvoiceWriteBatcher
 ):
     """Register MCP handlers with the router
     
@@ -27,9 +117,13 @@ def register_mcp_handlers(
         working_capital_optimizer: Working capital optimizer instance
         accounts_payable_optimizer: Accounts payable optimizer instance
         accounts_receivable_optimizer: Accounts receivable optimizer instance
+        invoice_batcher: Batcher that coalesces invoice creations
     """
     logger.info("Registering MCP handlers")
     
+    # Register content type negotiation handler
+    mcp_router.register_handler("mcp.negotiate", _handle_negotiate)
+    
     # Register Neo4j Cypher handler
     neo4j_handler = Neo4jCypherHandler(
         uri=working_capital_optimizer.neo4j_client.uri,
@@ -38,333 +132,316 @@ def register_mcp_handlers(
     )
     mcp_router.register_handler("neo4j.cypher", neo4j_handler.handle)
     
-    # Register working capital handlers
-    mcp_router.register_handler(
-        "finance.working_capital.optimize",
-        lambda msg: _handle_working_capital_optimize(msg, working_capital_optimizer)
-    )
+    neo4j_client = working_capital_optimizer.neo4j_client
     
-    mcp_router.register_handler(
-        "finance.working_capital.set_objective_weights",
-        lambda msg: _handle_set_objective_weights(msg, working_capital_optimizer)
-    )
+    # Finance handlers, also dispatched individually from batch messages
+    handlers = {
+        # Working capital handlers
+        "finance.working_capital.optimize":
+            partial(_handle_working_capital_optimize, optimizer=working_capital_optimizer),
+        "finance.working_capital.set_objective_weights":
+            partial(_handle_set_objective_weights, optimizer=working_capital_optimizer),
+        
+        # Accounts payable handlers
+        "finance.accounts_payable.optimize":
+            partial(_handle_accounts_payable_optimize, optimizer=accounts_payable_optimizer),
+        "finance.accounts_payable.set_supplier_importance":
+            partial(_handle_set_supplier_importance, optimizer=accounts_payable_optimizer),
+        
+        # Accounts receivable handlers
+        "finance.accounts_receivable.optimize":
+            partial(_handle_accounts_receivable_optimize, optimizer=accounts_receivable_optimizer),
+        "finance.accounts_receivable.set_customer_importance":
+            partial(_handle_set_customer_importance, optimizer=accounts_receivable_optimizer),
+        
+        # Invoice handlers
+        "finance.invoice.create":
+            partial(_handle_create_invoice, invoice_batcher=invoice_batcher),
+        "finance.invoice.get_by_type":
+            partial(_handle_get_invoices_by_type, neo4j_client=neo4j_client),
+        
+        # Cash flow handlers
+        "finance.cash_flow.forecast":
+            partial(_handle_get_cash_flow_forecast, neo4j_client=neo4j_client)
+    }
     
-    # Register accounts payable handlers
-    mcp_router.register_handler(
-        "finance.accounts_payable.optimize",
-        lambda msg: _handle_accounts_payable_optimize(msg, accounts_payable_optimizer)
-    )
+    for message_type, handler in handlers.items():
+        mcp_router.register_handler(message_type, handler)
     
-    mcp_router.register_handler(
-        "finance.accounts_payable.set_supplier_importance",
-        lambda msg: _handle_set_supplier_importance(msg, accounts_payable_optimizer)
-    )
+    # Register batch handler
+    mcp_router.register_handler("batch", partial(_handle_batch, handlers=handlers))
     
-    # Register accounts receivable handlers
-    mcp_router.register_handler(
-        "finance.accounts_receivable.optimize",
-        lambda msg: _handle_accounts_receivable_optimize(msg, accounts_receivable_optimizer)
-    )
+    logger.info("MCP handlers registered successfully")
+
+class _PayloadDecoder:
+    """Decodes message payloads as a request type according to their content type"""
     
-    mcp_router.register_handler(
-        "finance.accounts_receivable.set_customer_importance",
-        lambda msg: _handle_set_customer_importance(msg, accounts_receivable_optimizer)
-    )
+    def __init__(self, request_type):
+        """Initialize the decoder
+        
+        Args:
+            request_type: Type payloads are decoded and validated as
+        """
+        self.request_type = request_type
+        self._json_decoder = msgspec.json.Decoder(request_type)
+        self._msgpack_decoder = msgspec.msgpack.Decoder(request_type)
+        
+    def decode(self, msg):
+        """Decode the payload of an MCP message
+        
+        Args:
+            msg: MCP message
+            
+        Returns:
+            Decoded payload
+            
+        Raises:
+            msgspec.ValidationError: If the payload doesn't match the request type
+        """
+        if msg.get("content_type") == _NATIVE_CONTENT_TYPE:
+            return msgspec.convert(msg["payload"], self.request_type)
+        if msg.get("content_type") == MSGPACK_CONTENT_TYPE:
+            return self._msgpack_decoder.decode(msg["payload"])
+        return self._json_decoder.decode(msg.get("payload") or b"{}")
+
+def _dump_payload(msg, result):
+    """Encode a response payload in the content type of the request
     
-    # Register invoice handlers
-    mcp_router.register_handler(
-        "finance.invoice.create",
-        lambda msg: _handle_create_invoice(msg, working_capital_optimizer.neo4j_client)
-    )
+    Args:
+        msg: MCP message being answered
+        result: Result to encode
+        
+    Returns:
+        bytes: Encoded payload, the result itself for batch operations
+    """
+    if msg.get("content_type") == _NATIVE_CONTENT_TYPE:
+        return result
+    if msg.get("content_type") == MSGPACK_CONTENT_TYPE:
+        return _msgpack_encoder.encode(result)
+    return _dumps(result, option=_JSON_OPTIONS)
+
+def _handle_negotiate(msg):
+    """Handle payload content type negotiation
     
-    mcp_router.register_handler(
-        "finance.invoice.get_by_type",
-        lambda msg: _handle_get_invoices_by_type(msg, working_capital_optimizer.neo4j_client)
-    )
+    Args:
+        msg: MCP message
+        
+    Returns:
+        dict: Response message
+    """
+    content_type = msg.get("content_type", JSON_CONTENT_TYPE)
     
-    # Register cash flow handlers
-    mcp_router.register_handler(
-        "finance.cash_flow.forecast",
-        lambda msg: _handle_get_cash_flow_forecast(msg, working_capital_optimizer.neo4j_client)
-    )
+    if content_type not in SUPPORTED_CONTENT_TYPES:
+        return _err(f"Unsupported content type: {content_type}")
     
-    logger.info("MCP handlers registered successfully")
+    return {
+        "status": "success",
+        "content_type": content_type
+    }
 
-def _handle_working_capital_optimize(msg, optimizer):
-    """Handle working capital optimization request
+def mcp_safe(request_type):
+    """Wrap a handler body with payload validation, response encoding and error handling
+    
+    The wrapped function receives the payload decoded as request_type and returns
+    the result to send back, or an error response.
     
     Args:
-        msg: MCP message
-        optimizer: Working capital optimizer instance
+        request_type: Type the payload is decoded and validated as
         
     Returns:
-        dict: Response message
+        Decorator turning a handler body coroutine function into a handler
+        taking an MCP message and returning a response message
     """
-    try:
-        payload = json.loads(msg.get("payload", "{}"))
-        scenario = payload.get("scenario", "base")
+    payload_decoder = _PayloadDecoder(request_type)
+    
+    def decorator(fn):
+        @wraps(fn)
+        async def wrap(msg, **kw):
+            try:
+                result = await fn(payload_decoder.decode(msg), **kw)
+                if isinstance(result, _ErrorResponse):
+                    return result
+                
+                return {
+                    "status": "success",
+                    "payload": _dump_payload(msg, result)
+                }
+            except msgspec.ValidationError as e:
+                logger.warning("Invalid payload for %s: %s", fn.__name__, e)
+                return _err(e)
+            except Exception as e:
+                logger.exception("Error in %s", fn.__name__)
+                return _err(e)
+        return wrap
+    return decorator
+
+async def _unsupported_operation(op_type):
+    """Build the response for a batch operation without a handler"""
+    return _err(f"Unsupported batch operation: {op_type}")
+
+@mcp_safe(BatchRequest)
+async def _handle_batch(request, *, handlers):
+    """Handle a batch of operations sent in a single message
+    
+    Args:
+        request: Batch request holding a list of operations
+        handlers: Handlers by message type that operations may target
         
-        result = optimizer.optimize(scenario=scenario)
+    Returns:
+        list: One response per operation, in order
+    """
+    calls = []
+    for op in request.ops:
+        op_type = op.get("type")
+        handler = handlers.get(op_type)
         
-        return {
-            "status": "success",
-            "payload": json.dumps(result)
-        }
-    except Exception as e:
-        logger.error(f"Error in working capital optimization: {e}")
-        return {
-            "status": "error",
-            "error": str(e)
-        }
-
-def _handle_set_objective_weights(msg, optimizer):
-    """Handle setting objective weights
+        if handler is None:
+            calls.append(_unsupported_operation(op_type))
+            continue
+        
+        calls.append(handler({
+            "type": op_type,
+            "payload": op.get("payload", {}),
+            "content_type": _NATIVE_CONTENT_TYPE
+        }))
+    
+    # Operations run concurrently, results keep the order of the ops
+    return await asyncio.gather(*calls)
+
+@mcp_safe(WorkingCapitalOptimizeRequest)
+async def _handle_working_capital_optimize(request, *, optimizer):
+    """Handle working capital optimization request
     
     Args:
-        msg: MCP message
+        request: Working capital optimization request
         optimizer: Working capital optimizer instance
         
     Returns:
-        dict: Response message
+        dict: Optimization result
     """
-    try:
-        payload = json.loads(msg.get("payload", "{}"))
-        weights = payload.get("weights", {})
-        
-        optimizer.set_objective_weights(weights)
+    return await asyncio.to_thread(optimizer.optimize, scenario=request.scenario)
+
+@mcp_safe(ObjectiveWeightsRequest)
+async def _handle_set_objective_weights(request, *, optimizer):
+    """Handle setting objective weights
+    
+    Args:
+        request: Objective weights request
+        optimizer: Working capital optimizer instance
         
-        return {
-            "status": "success",
-            "payload": json.dumps({"weights": weights})
-        }
-    except Exception as e:
-        logger.error(f"Error setting objective weights: {e}")
-        return {
-            "status": "error",
-            "error": str(e)
-        }
-
-def _handle_accounts_payable_optimize(msg, optimizer):
+    Returns:
+        dict: Weights that were set
+    """
+    optimizer.set_objective_weights(request.weights)
+    
+    return {"weights": request.weights}
+
+@mcp_safe(AccountsPayableOptimizeRequest)
+async def _handle_accounts_payable_optimize(request, *, optimizer):
     """Handle accounts payable optimization request
     
     Args:
-        msg: MCP message
+        request: Accounts payable optimization request
         optimizer: Accounts payable optimizer instance
         
     Returns:
-        dict: Response message
+        dict: Optimization result
     """
-    try:
-        payload = json.loads(msg.get("payload", "{}"))
-        cash_position = payload.get("cash_position", 0)
-        
-        result = optimizer.optimize_payment_schedule(cash_position=cash_position)
-        
-        return {
-            "status": "success",
-            "payload": json.dumps(result)
-        }
-    except Exception as e:
-        logger.error(f"Error in accounts payable optimization: {e}")
-        return {
-            "status": "error",
-            "error": str(e)
-        }
-
-def _handle_set_supplier_importance(msg, optimizer):
+    return await asyncio.to_thread(optimizer.optimize_payment_schedule, cash_position=request.cash_position)
+
+@mcp_safe(SupplierImportanceRequest)
+async def _handle_set_supplier_importance(request, *, optimizer):
     """Handle setting supplier importance
     
     Args:
-        msg: MCP message
+        request: Supplier importance request
         optimizer: Accounts payable optimizer instance
         
     Returns:
-        dict: Response message
+        dict: Importance that was set
     """
-    try:
-        payload = json.loads(msg.get("payload", "{}"))
-        supplier_id = payload.get("supplier_id")
-        importance_score = payload.get("importance_score")
-        
-        if not supplier_id or importance_score is None:
-            return {
-                "status": "error",
-                "error": "Missing supplier_id or importance_score"
-            }
-        
-        optimizer.set_supplier_importance(supplier_id, importance_score)
-        
-        return {
-            "status": "success",
-            "payload": json.dumps({
-                "supplier_id": supplier_id,
-                "importance_score": importance_score
-            })
-        }
-    except Exception as e:
-        logger.error(f"Error setting supplier importance: {e}")
-        return {
-            "status": "error",
-            "error": str(e)
-        }
-
-def _handle_accounts_receivable_optimize(msg, optimizer):
+    optimizer.set_supplier_importance(request.supplier_id, request.importance_score)
+    
+    return {
+        "supplier_id": request.supplier_id,
+        "importance_score": request.importance_score
+    }
+
+@mcp_safe(AccountsReceivableOptimizeRequest)
+async def _handle_accounts_receivable_optimize(request, *, optimizer):
     """Handle accounts receivable optimization request
     
     Args:
-        msg: MCP message
+        request: Accounts receivable optimization request
         optimizer: Accounts receivable optimizer instance
         
     Returns:
-        dict: Response message
+        dict: Optimization result
     """
-    try:
-        payload = json.loads(msg.get("payload", "{}"))
-        cash_position = payload.get("cash_position", 0)
-        objective = payload.get("objective", "balanced")
-        
-        result = optimizer.optimize_collection_strategy(
-            cash_position=cash_position,
-            objective=objective
-        )
-        
-        return {
-            "status": "success",
-            "payload": json.dumps(result)
-        }
-    except Exception as e:
-        logger.error(f"Error in accounts receivable optimization: {e}")
-        return {
-            "status": "error",
-            "error": str(e)
-        }
-
-def _handle_set_customer_importance(msg, optimizer):
+    return await asyncio.to_thread(
+        optimizer.optimize_collection_strategy,
+        cash_position=request.cash_position,
+        objective=request.objective
+    )
+
+@mcp_safe(CustomerImportanceRequest)
+async def _handle_set_customer_importance(request, *, optimizer):
     """Handle setting customer importance
     
     Args:
-        msg: MCP message
+        request: Customer importance request
         optimizer: Accounts receivable optimizer instance
         
     Returns:
-        dict: Response message
+        dict: Importance that was set
     """
-    try:
-        payload = json.loads(msg.get("payload", "{}"))
-        customer_id = payload.get("customer_id")
-        importance_score = payload.get("importance_score")
-        
-        if not customer_id or importance_score is None:
-            return {
-                "status": "error",
-                "error": "Missing customer_id or importance_score"
-            }
-        
-        optimizer.set_customer_importance(customer_id, importance_score)
-        
-        return {
-            "status": "success",
-            "payload": json.dumps({
-                "customer_id": customer_id,
-                "importance_score": importance_score
-            })
-        }
-    except Exception as e:
-        logger.error(f"Error setting customer importance: {e}")
-        return {
-            "status": "error",
-            "error": str(e)
-        }
-
-def _handle_create_invoice(msg, neo4j_client):
+    optimizer.set_customer_importance(request.customer_id, request.importance_score)
+    
+    return {
+        "customer_id": request.customer_id,
+        "importance_score": request.importance_score
+    }
+
+@mcp_safe(dict)
+async def _handle_create_invoice(payload, *, invoice_batcher):
     """Handle creating a new invoice
     
     Args:
-        msg: MCP message
-        neo4j_client: Neo4j client instance
+        payload: Message payload
+        invoice_batcher: Batcher that coalesces invoice creations
         
     Returns:
-        dict: Response message
+        dict: Created invoice
     """
-    try:
-        payload = json.loads(msg.get("payload", "{}"))
-        
-        result = neo4j_client.create_invoice(payload)
-        
-        if not result:
-            return {
-                "status": "error",
-                "error": "Failed to create invoice"
-            }
-        
-        return {
-            "status": "success",
-            "payload": json.dumps(result)
-        }
-    except Exception as e:
-        logger.error(f"Error creating invoice: {e}")
-        return {
-            "status": "error",
-            "error": str(e)
-        }
-
-def _handle_get_invoices_by_type(msg, neo4j_client):
+    result = await invoice_batcher.create_invoice(payload)
+    
+    if not result:
+        return _ERR_CREATE_INVOICE
+    
+    return result
+
+@mcp_safe(InvoicesByTypeRequest)
+async def _handle_get_invoices_by_type(request, *, neo4j_client):
     """Handle getting invoices by type
     
     Args:
-        msg: MCP message
+        request: Invoices by type request
         neo4j_client: Neo4j client instance
         
     Returns:
-        dict: Response message
+        list: Invoices of the requested type
     """
-    try:
-        payload = json.loads(msg.get("payload", "{}"))
-        invoice_type = payload.get("type")
-        days_horizon = payload.get("days_horizon", 90)
-        
-        if not invoice_type or invoice_type not in ["AR", "AP"]:
-            return {
-                "status": "error",
-                "error": "Missing or invalid invoice type"
-            }
-        
-        invoices = neo4j_client.get_invoices_by_type(invoice_type, days_horizon)
-        
-        return {
-            "status": "success",
-            "payload": json.dumps(invoices)
-        }
-    except Exception as e:
-        logger.error(f"Error getting invoices: {e}")
-        return {
-            "status": "error",
-            "error": str(e)
-        }
-
-def _handle_get_cash_flow_forecast(msg, neo4j_client):
+    return await asyncio.to_thread(neo4j_client.get_invoices_by_type, request.type, request.days_horizon)
+
+@mcp_safe(CashFlowForecastRequest)
+async def _handle_get_cash_flow_forecast(request, *, neo4j_client):
     """Handle getting cash flow forecast
     
     Args:
-        msg: MCP message
+        request: Cash flow forecast request
         neo4j_client: Neo4j client instance
         
     Returns:
-        dict: Response message
+        dict: Cash flow forecast
     """
-    try:
-        payload = json.loads(msg.get("payload", "{}"))
-        days_horizon = payload.get("days_horizon", 90)
-        
-        forecast = neo4j_client.get_cash_flow_forecast(days_horizon)
-        
-        return {
-            "status": "success",
-            "payload": json.dumps(forecast)
-        }
-    except Exception as e:
-        logger.error(f"Error getting cash flow forecast: {e}")
-        return {
-            "status": "error",
-            "error": str(e)
-        }
+    return await asyncio.to_thread(neo4j_client.get_cash_flow_forecast, request.days_horizon)
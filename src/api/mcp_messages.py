@@ -0,0 +1,16 @@
+"""
+MCP Message Types for Finance MCP Application
+Shared message envelope and content types for MCP clients and handlers
+"""
+import msgspec
+
+# Payload content types understood by the Finance MCP server
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+JSON_CONTENT_TYPE = "application/json"
+SUPPORTED_CONTENT_TYPES = (MSGPACK_CONTENT_TYPE, JSON_CONTENT_TYPE)
+
+class MCPMessage(msgspec.Struct, array_like=True):
+    """MCP message envelope, encoded as a fixed-shape array instead of a map"""
+    type: str
+    payload: bytes
+    content_type: str = MSGPACK_CONTENT_TYPE
@@ -3,31 +3,118 @@ Neo4j Client for Finance MCP Application
 Handles connections and queries to the Neo4j graph database
 """
 import logging
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, Result, RoutingControl
 from neo4j.exceptions import ServiceUnavailable, AuthError
 
 logger = logging.getLogger(__name__)
 
+# Cypher queries, kept as constants so every call sends identical query text
+_CREATE_INVOICE_CQL = """
+CREATE (i:Invoice {
+    id: $id,
+    amount: $amount,
+    dueDate: $dueDate,
+    issueDate: $issueDate,
+    type: $type
+})
+WITH i
+MATCH (entity)
+WHERE entity.id = $entityId AND 
+      (($type = 'AR' AND entity:Customer) OR ($type = 'AP' AND entity:Supplier))
+CREATE (entity)-[r:HAS_INVOICE]->(i)
+RETURN i
+"""
+
+_CREATE_INVOICES_CQL = """
+UNWIND $rows AS r
+CREATE (i:Invoice {
+    id: r.id,
+    amount: r.amount,
+    dueDate: r.dueDate,
+    issueDate: r.issueDate,
+    type: r.type
+})
+WITH i, r
+MATCH (entity)
+WHERE entity.id = r.entityId AND 
+      ((r.type = 'AR' AND entity:Customer) OR (r.type = 'AP' AND entity:Supplier))
+CREATE (entity)-[:HAS_INVOICE]->(i)
+RETURN i
+"""
+
+_INVOICES_BY_TYPE_CQL = """
+MATCH (i:Invoice)
+WHERE i.type = $type AND i.dueDate <= date() + duration({days: $horizon})
+RETURN i {.*} AS i
+ORDER BY i.dueDate
+"""
+
+# Same invoices, joined with the ID of the supplier or customer they belong to
+_INVOICES_WITH_COUNTERPARTY_BY_TYPE_CQL = """
+MATCH (i:Invoice)
+WHERE i.type = $type AND i.dueDate <= date() + duration({days: $horizon})
+RETURN i {.*} AS i, head([(c)-[:HAS_INVOICE]->(i) | c.id]) AS counterparty_id
+ORDER BY i.dueDate
+"""
+
+# Aggregates into one record of columns instead of one record per day
+_CASH_FLOW_CQL = """
+MATCH (i:Invoice)
+WHERE i.dueDate <= date() + duration({days: $horizon})
+WITH i.dueDate AS date, 
+     sum(CASE WHEN i.type = 'AR' THEN i.amount ELSE 0 END) AS inflow,
+     sum(CASE WHEN i.type = 'AP' THEN i.amount ELSE 0 END) AS outflow
+ORDER BY date
+RETURN collect(date) AS date, collect(inflow) AS inflow, collect(outflow) AS outflow
+"""
+
+# Parameters for the default 90 day horizon, shared instead of rebuilt per call
+_PARAMS_AR_90 = {"type": "AR", "horizon": 90}
+_PARAMS_AP_90 = {"type": "AP", "horizon": 90}
+_PARAMS_HORIZON_90 = {"horizon": 90}
+
 class Neo4jClient:
     """Client for interacting with Neo4j graph database"""
     
-    def __init__(self, uri, user, password):
+    def __init__(self, uri, user, password, max_connection_pool_size=100, connection_acquisition_timeout=60,
+                 max_connection_lifetime=3600, fetch_size=1000, database="neo4j"):
         """Initialize Neo4j client with connection parameters
         
         Args:
             uri (str): Neo4j connection URI
             user (str): Neo4j username
             password (str): Neo4j password
+            max_connection_pool_size (int): Maximum connections kept in the driver pool
+            connection_acquisition_timeout (float): Seconds to wait for a pooled connection
+            max_connection_lifetime (float): Seconds before a pooled connection is replaced
+            fetch_size (int): Records pulled from the server per round trip
+            database (str): Database to run queries against
         """
         self.uri = uri
         self.user = user
         self.password = password
+        self.max_connection_pool_size = max_connection_pool_size
+        self.connection_acquisition_timeout = connection_acquisition_timeout
+        self.max_connection_lifetime = max_connection_lifetime
+        self.fetch_size = fetch_size
+        self.database = database
         self.driver = None
+        self._write_listeners = []
         
     def connect(self):
         """Connect to Neo4j database"""
         try:
-            self.driver = GraphDatabase.driver(self.uri, auth=(self.user, self.password))
+            self.driver = GraphDatabase.driver(
+                self.uri,
+                auth=(self.user, self.password),
+                max_connection_pool_size=self.max_connection_pool_size,
+                connection_acquisition_timeout=self.connection_acquisition_timeout,
+                max_connection_lifetime=self.max_connection_lifetime,
+                keep_alive=True,
+                fetch_size=self.fetch_size,
+                user_agent="finance-mcp",
+                notifications_min_severity="WARNING"
+            )
             # Verify connection
             self.driver.verify_connectivity()
             logger.info(f"Connected to Neo4j database at {self.uri}")
@@ -58,24 +145,31 @@ class Neo4jClient:
         # Create indexes for performance
         indexes = [
             "CREATE INDEX IF NOT EXISTS FOR (i:Invoice) ON (i.dueDate)",
+            "CREATE INDEX invoice_type_due IF NOT EXISTS FOR (i:Invoice) ON (i.type, i.dueDate)",
             "CREATE INDEX IF NOT EXISTS FOR (p:Payment) ON (p.date)"
         ]
         
-        with self.driver.session() as session:
-            for constraint in constraints:
-                session.run(constraint)
+        def _init_tx(tx):
+            for statement in constraints + indexes:
+                tx.run(statement)
                 
-            for index in indexes:
-                session.run(index)
+        # Statements are idempotent, so the single transaction is safe to retry
+        with self.driver.session() as session:
+            session.execute_write(_init_tx)
                 
         logger.info("Neo4j schema initialized with constraints and indexes")
     
-    def run_query(self, query, parameters=None):
+    def run_query(self, query, parameters=None, routing=RoutingControl.READ):
         """Run a Cypher query against Neo4j
         
+        The query runs in a managed transaction that the driver retries with
+        backoff on transient errors and dropped connections.
+        
         Args:
             query (str): Cypher query to execute
             parameters (dict, optional): Query parameters
+            routing (RoutingControl): Route the query to a reader, or to a writer
+                with RoutingControl.WRITE for queries that modify data
             
         Returns:
             list: Query results
@@ -86,9 +180,28 @@ class Neo4jClient:
         if parameters is None:
             parameters = {}
             
-        with self.driver.session() as session:
-            result = session.run(query, parameters)
-            return [record.data() for record in result]
+        # Materialize all records as dicts in one pass over the result
+        records = self.driver.execute_query(
+            query,
+            parameters_=parameters,
+            routing_=routing,
+            database_=self.database,
+            result_transformer_=Result.data
+        )
+        
+        if routing == RoutingControl.WRITE:
+            for listener in self._write_listeners:
+                listener()
+                
+        return records
+        
+    def add_write_listener(self, listener):
+        """Register a callback run after every write query, e.g. to invalidate caches
+        
+        Args:
+            listener (callable): Callback taking no arguments
+        """
+        self._write_listeners.append(listener)
             
     # Financial data specific methods
     
@@ -101,43 +214,41 @@ class Neo4jClient:
         Returns:
             dict: Created invoice data
         """
-        query = """
-        CREATE (i:Invoice {
-            id: $id,
-            amount: $amount,
-            dueDate: $dueDate,
-            issueDate: $issueDate,
-            type: $type
-        })
-        WITH i
-        MATCH (entity)
-        WHERE entity.id = $entityId AND 
-              (($type = 'AR' AND entity:Customer) OR ($type = 'AP' AND entity:Supplier))
-        CREATE (entity)-[r:HAS_INVOICE]->(i)
-        RETURN i
-        """
-        
-        result = self.run_query(query, invoice_data)
+        result = self.run_query(_CREATE_INVOICE_CQL, invoice_data, routing=RoutingControl.WRITE)
         return result[0] if result else None
         
-    def get_invoices_by_type(self, invoice_type, days_horizon=90):
+    def create_invoices_bulk(self, rows):
+        """Create several invoices in a single transaction
+        
+        Args:
+            rows (list): Invoice data dicts in the format accepted by create_invoice
+            
+        Returns:
+            list: Created invoice data for the invoices linked to their entity
+        """
+        return self.run_query(_CREATE_INVOICES_CQL, {"rows": rows}, routing=RoutingControl.WRITE)
+        
+    def get_invoices_by_type(self, invoice_type, days_horizon=90, include_counterparty=False):
         """Get invoices by type (AR or AP) within a time horizon
         
         Args:
             invoice_type (str): Type of invoice - 'AR' or 'AP'
             days_horizon (int): Number of days to look ahead
+            include_counterparty (bool): Also return the ID of each invoice's supplier
+                or customer as counterparty_id, None if it has none
             
         Returns:
             list: Invoices matching the criteria
         """
-        query = """
-        MATCH (i:Invoice)
-        WHERE i.type = $type AND i.dueDate <= date() + duration({days: $horizon})
-        RETURN i
-        ORDER BY i.dueDate
-        """
-        
-        return self.run_query(query, {"type": invoice_type, "horizon": days_horizon})
+        if days_horizon == 90 and invoice_type == "AR":
+            parameters = _PARAMS_AR_90
+        elif days_horizon == 90 and invoice_type == "AP":
+            parameters = _PARAMS_AP_90
+        else:
+            parameters = {"type": invoice_type, "horizon": days_horizon}
+            
+        query = _INVOICES_WITH_COUNTERPARTY_BY_TYPE_CQL if include_counterparty else _INVOICES_BY_TYPE_CQL
+        return self.run_query(query, parameters, routing=RoutingControl.READ)
         
     def get_cash_flow_forecast(self, days_horizon=90):
         """Get cash flow forecast for the specified horizon
@@ -146,15 +257,8 @@ class Neo4jClient:
             days_horizon (int): Number of days to forecast
             
         Returns:
-            dict: Daily cash flow forecast
-        """
-        query = """
-        MATCH (i:Invoice)
-        WHERE i.dueDate <= date() + duration({days: $horizon})
-        RETURN i.dueDate AS date, 
-               sum(CASE WHEN i.type = 'AR' THEN i.amount ELSE 0 END) AS inflow,
-               sum(CASE WHEN i.type = 'AP' THEN i.amount ELSE 0 END) AS outflow
-        ORDER BY date
+            dict: Daily cash flow forecast as date, inflow and outflow columns
         """
+        parameters = _PARAMS_HORIZON_90 if days_horizon == 90 else {"horizon": days_horizon}
         
-        return self.run_query(query, {"horizon": days_horizon})
+        return self.run_query(_CASH_FLOW_CQL, parameters, routing=RoutingControl.READ)[0]
@@ -0,0 +1,137 @@
+"""
+Write Batcher for Finance MCP Application
+Coalesces concurrent invoice writes into bulk Neo4j transactions
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class InvoiceWriteBatcher:
+    """
+    Queues invoice creations and flushes them to Neo4j in batches, every
+    max_batch_size invoices or after a linger time that adapts to the load
+    """
+
+    def __init__(self, neo4j_client, max_batch_size=1000, max_delay=0.005, smoothing=0.2):
+        """Initialize the write batcher
+
+        Args:
+            neo4j_client: Neo4j client instance
+            max_batch_size (int): Maximum invoices written per transaction
+            max_delay (float): Maximum seconds a write waits for others to join its batch
+            smoothing (float): Weight of the latest batch size in the moving average
+        """
+        self.neo4j_client = neo4j_client
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.smoothing = smoothing
+        self._avg_batch_size = 1.0
+        self._queue = asyncio.Queue()
+        self._flusher = None
+
+    async def create_invoice(self, invoice_data):
+        """Queue an invoice for creation and wait for its batch to be written
+
+        Args:
+            invoice_data (dict): Invoice data in the format accepted by Neo4jClient.create_invoice
+
+        Returns:
+            dict: Created invoice data, None if the invoice could not be linked to its entity
+        """
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((invoice_data, future))
+        return await future
+
+    async def close(self):
+        """Write the queued invoices and stop the flusher task"""
+        if self._flusher is None:
+            return
+
+        await self._queue.join()
+        self._flusher.cancel()
+        self._flusher = None
+
+    def _linger_time(self):
+        """Get how long to wait for more writes before flushing a batch
+
+        Under light load batches hold a single invoice and writes are flushed
+        immediately; as batches fill up the linger time grows to max_delay.
+        """
+        return self.max_delay * min(self._avg_batch_size / self.max_batch_size, 1.0)
+
+    async def _run(self):
+        """Collect queued invoices into batches and write them"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._linger_time()
+
+            while len(batch) < self.max_batch_size:
+                if self._queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    batch.append(self._queue.get_nowait())
+
+            await self._flush(batch)
+
+            self._avg_batch_size += self.smoothing * (len(batch) - self._avg_batch_size)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _flush(self, batch):
+        """Write a batch of invoices and resolve their futures"""
+        rows = [invoice_data for invoice_data, _ in batch]
+        try:
+            created = await asyncio.to_thread(self.neo4j_client.create_invoices_bulk, rows)
+        except Exception as e:
+            if len(batch) == 1:
+                _, future = batch[0]
+                if not future.done():
+                    future.set_exception(e)
+                return
+
+            # One bad row (e.g. a duplicate id) fails the whole transaction,
+            # write the rows one by one so only the failing ones are reported
+            logger.warning("Error writing batch of %s invoices, retrying individually: %s", len(rows), e)
+            results = await asyncio.to_thread(self._create_each, rows)
+            for (_, future), (record, error) in zip(batch, results):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(record)
+            return
+
+        by_id = {record["i"]["id"]: record for record in created}
+        for invoice_data, future in batch:
+            if not future.done():
+                future.set_result(by_id.get(invoice_data.get("id")))
+
+    def _create_each(self, rows):
+        """Create invoices one transaction at a time
+
+        Args:
+            rows (list): Invoice data dicts
+
+        Returns:
+            list: (created invoice data, None) or (None, exception) for each row
+        """
+        results = []
+        for row in rows:
+            try:
+                results.append((self.neo4j_client.create_invoice(row), None))
+            except Exception as e:
+                logger.error("Error creating invoice %s: %s", row.get("id"), e)
+                results.append((None, e))
+        return results
@@ -4,9 +4,12 @@ Finance MCP Application - Main Entry Point
 Implements a FastMCP server with Neo4j integration for financial data processing
 """
 import os
+import asyncio
 import logging
 import uvicorn
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 from fastmcp import MCPServer
 from fastmcp.router import MCPRouter
@@ -15,9 +18,7 @@ from fastmcp.router import MCPRouter
 from api.mcp_handlers import register_mcp_handlers
 from api.rest_endpoints import router as api_router
 from database.neo4j_client import Neo4jClient
-from models.working_capital import WorkingCapitalOptimizer
-from models.accounts_payable import AccountsPayableOptimizer
-from models.accounts_receivable import AccountsReceivableOptimizer
+from database.write_batcher import InvoiceWriteBatcher
 
 # Load environment variables
 load_dotenv()
@@ -33,7 +34,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="Finance MCP Application",
     description="Finance application using FastMCP and Neo4j MCP for working capital optimization",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add API routes
@@ -43,13 +45,13 @@ app.include_router(api_router, prefix="/api")
 neo4j_client = Neo4jClient(
     uri=os.getenv("NEO4J_URI", "bolt://localhost:7687"),
     user=os.getenv("NEO4J_USER", "neo4j"),
-    password=os.getenv("NEO4J_PASSWORD", "password")
+    password=os.getenv("NEO4J_PASSWORD", "password"),
+    max_connection_pool_size=int(os.getenv("NEO4J_POOL") or "50"),
+    connection_acquisition_timeout=30
 )
 
-# Initialize financial models
-working_capital_optimizer = WorkingCapitalOptimizer(neo4j_client)
-accounts_payable_optimizer = AccountsPayableOptimizer(neo4j_client)
-accounts_receivable_optimizer = AccountsReceivableOptimizer(neo4j_client)
+# Coalesce MCP invoice creations into bulk writes
+invoice_batcher = InvoiceWriteBatcher(neo4j_client)
 
 # Create MCP Router
 mcp_router = MCPRouter()
@@ -61,18 +63,35 @@ mcp_server = MCPServer(
     router=mcp_router
 )
 
-# Register MCP handlers
-register_mcp_handlers(
-    mcp_router, 
-    working_capital_optimizer, 
-    accounts_payable_optimizer, 
-    accounts_receivable_optimizer
-)
-
 # Start MCP server when application starts
 @app.on_event("startup")
 async def startup_event():
     logger.info("Starting Finance MCP Application")
+    # Size the default executor used for off-loop optimizer runs
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=os.cpu_count()))
+    # Import the financial models here, they pull in numba and the compiled
+    # kernels which would otherwise slow down every reload. The API modules
+    # only import them for type hints (the neo4j driver still loads numpy
+    # and pandas on its own when they are installed)
+    from models.working_capital import WorkingCapitalOptimizer
+    from models.accounts_payable import AccountsPayableOptimizer
+    from models.accounts_receivable import AccountsReceivableOptimizer
+    
+    # Initialize financial models and expose shared components to the API dependencies
+    app.state.neo4j_client = neo4j_client
+    app.state.working_capital_optimizer = WorkingCapitalOptimizer(neo4j_client)
+    app.state.accounts_payable_optimizer = AccountsPayableOptimizer(neo4j_client)
+    app.state.accounts_receivable_optimizer = AccountsReceivableOptimizer(neo4j_client)
+    
+    # Register MCP handlers
+    register_mcp_handlers(
+        mcp_router, 
+        app.state.working_capital_optimizer, 
+        app.state.accounts_payable_optimizer, 
+        app.state.accounts_receivable_optimizer,
+        invoice_batcher
+    )
+    
     # Connect to Neo4j
     neo4j_client.connect()
     # Start MCP server
@@ -85,14 +104,26 @@ async def shutdown_event():
     logger.info("Shutting down Finance MCP Application")
     # Stop MCP server
     mcp_server.stop()
+    # Write invoices still queued for creation
+    await invoice_batcher.close()
     # Close Neo4j connection
     neo4j_client.close()
 
 if __name__ == "__main__":
+    # Auto-reload in development. Always a single worker: every worker runs
+    # startup_event, which starts the embedded MCP server on MCP_PORT, so a
+    # second worker would collide on that port. Each worker would also hold its
+    # own invoice write batcher and Neo4j pool. Scale out with separate
+    # processes once the MCP server runs outside the API process.
+    dev = os.getenv("ENV") == "dev"
+    
     # Run FastAPI application with Uvicorn
     uvicorn.run(
         "main:app", 
         host=os.getenv("API_HOST", "0.0.0.0"),
         port=int(os.getenv("API_PORT", "8000")),
-        reload=True
+        loop="auto",  # uvloop where installed (not on Windows), asyncio otherwise
+        http="httptools",
+        workers=1,
+        reload=dev
     )
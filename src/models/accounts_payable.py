@@ -5,7 +5,10 @@ Implements the mathematical model for AP optimization
 import logging
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime
+from models.query_cache import QueryCache
+from models.prioritized_batch import PrioritizedBatch
+from models.kernels import PaymentType, allocate_payments, grouped_sums, payable_priority, priority_order
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +29,10 @@ class AccountsPayableOptimizer:
         self.borrowing_rate = 0.0001  # Daily borrowing rate
         self.min_cash_buffer = 100000  # Minimum cash buffer to maintain
         self.supplier_importance = {}  # Dictionary of supplier importance scores
+        self.query_cache = QueryCache(maxsize=256, ttl=60)
+        
+        # Drop cached query results whenever the database is written to
+        neo4j_client.add_write_listener(self.invalidate_cache)
         
     def set_supplier_importance(self, supplier_id, importance_score):
         """Set the importance score for a supplier
@@ -40,136 +47,122 @@ class AccountsPayableOptimizer:
         self.supplier_importance[supplier_id] = importance_score
         logger.info(f"Set importance score for supplier {supplier_id} to {importance_score}")
         
-    def get_payable_invoices(self):
+    def invalidate_cache(self):
+        """Drop cached invoice lookups"""
+        self.query_cache.clear()
+        
+    def get_payable_invoices(self, today=None):
         """Get all payable invoices within the optimization horizon
         
+        Args:
+            today (datetime.date, optional): Current date, defaults to today
+            
         Returns:
-            list: List of payable invoices
+            list: List of payable invoices with their supplier IDs
         """
-        return self.neo4j_client.get_invoices_by_type('AP', self.horizon_days)
+        if today is None:
+            today = datetime.now().date()
+            
+        # The query is relative to today, so results are only reused within the day
+        key = ('invoices', self.horizon_days, today)
+        return self.query_cache.get_or_load(
+            key,
+            lambda: self.neo4j_client.get_invoices_by_type('AP', self.horizon_days, include_counterparty=True)
+        )
         
-    def optimize_payment_schedule(self, cash_position, cash_forecast=None):
+    def optimize_payment_schedule(self, cash_position, cash_forecast=None, top_k=None):
         """Optimize the payment schedule for accounts payable
         
         Args:
             cash_position (float): Current cash position
             cash_forecast (pd.DataFrame, optional): Cash flow forecast
+            top_k (int, optional): Only schedule the top_k highest priority invoices
             
         Returns:
             dict: Optimized payment schedule
         """
         logger.info("Optimizing accounts payable payment schedule")
         
+        # Use the same date throughout the run
+        today = datetime.now().date()
+        
         # Get payable invoices
-        invoices = self.get_payable_invoices()
+        invoices = self.get_payable_invoices(today)
         
         # If no cash forecast provided, get it from the database
         if cash_forecast is None:
             forecast_data = self.neo4j_client.get_cash_flow_forecast(self.horizon_days)
             cash_forecast = pd.DataFrame(forecast_data)
             
-        # Create payment schedule
-        payment_schedule = []
+        # Sort invoices by priority
+        batch = self._prioritize_invoices(invoices, top_k, today)
         
-        # Track remaining cash
-        remaining_cash = cash_position
+        today = np.datetime64(today, 'D')
         
-        # Sort invoices by priority
-        prioritized_invoices = self._prioritize_invoices(invoices)
+        # Calculate early payment discounts, zero where no discount is available
+        discount_amounts = batch.amounts * batch.discount_rates
         
-        # Process each invoice
-        for invoice in prioritized_invoices:
-            inv = invoice['invoice']
-            priority = invoice['priority']
-            supplier_id = invoice['supplier_id']
-            
-            # Get invoice details
-            amount = inv['amount']
-            due_date = datetime.strptime(inv['dueDate'], '%Y-%m-%d').date()
-            today = datetime.now().date()
-            days_until_due = (due_date - today).days
-            
-            # Check if early payment discount is available
-            has_discount = False
-            discount_amount = 0
-            discount_date = None
-            
-            if 'earlyPaymentDate' in inv and 'discountRate' in inv:
-                has_discount = True
-                discount_rate = inv['discountRate']
-                discount_amount = amount * discount_rate
-                discount_date = datetime.strptime(inv['earlyPaymentDate'], '%Y-%m-%d').date()
-                days_until_discount = (discount_date - today).days
-            
-            # Determine optimal payment date
-            if has_discount:
-                # Calculate benefit of taking discount
-                discount_benefit = discount_amount
-                
-                # Calculate cost of early payment (opportunity cost)
-                days_early = days_until_due - days_until_discount
-                opportunity_cost = amount * self.borrowing_rate * days_early
-                
-                # If discount benefit exceeds opportunity cost, pay by discount date
-                if discount_benefit > opportunity_cost and remaining_cash >= amount:
-                    payment_date = discount_date
-                    payment_amount = amount - discount_amount
-                    payment_type = "early_with_discount"
-                    remaining_cash -= payment_amount
-                else:
-                    # Pay on due date
-                    payment_date = due_date
-                    payment_amount = amount
-                    payment_type = "on_due_date"
-                    remaining_cash -= payment_amount
-            else:
-                # No discount available
-                
-                # Check supplier importance
-                importance = self.supplier_importance.get(supplier_id, 0.5)
-                
-                if importance > 0.8:
-                    # High importance supplier - pay on time or early
-                    if days_until_due <= 5 and remaining_cash >= amount:
-                        payment_date = today
-                        payment_type = "early_important_supplier"
-                    else:
-                        payment_date = due_date
-                        payment_type = "on_due_date"
-                    payment_amount = amount
-                    remaining_cash -= payment_amount
-                elif remaining_cash < self.min_cash_buffer + amount:
-                    # Cash is tight - delay payment if possible
-                    delay_days = min(10, max(1, int(30 * (1 - importance))))
-                    payment_date = due_date + timedelta(days=delay_days)
-                    payment_amount = amount
-                    payment_type = "delayed_cash_constraint"
-                else:
-                    # Normal payment on due date
-                    payment_date = due_date
-                    payment_amount = amount
-                    payment_type = "on_due_date"
-                    remaining_cash -= payment_amount
-            
-            # Add to payment schedule
-            payment_schedule.append({
-                'invoice_id': inv['id'],
+        # Take the discount if its benefit exceeds the opportunity cost of paying early
+        days_early = batch.days_until_due - np.where(
+            batch.has_discount, (batch.discount_dates - today).astype(np.int64), 0
+        )
+        discount_worthwhile = discount_amounts > batch.amounts * self.borrowing_rate * days_early
+        
+        # Decide how to pay each invoice from the remaining cash, in priority order
+        payment_types, payment_amounts, remaining_cash = allocate_payments(
+            batch.amounts, discount_amounts, batch.has_discount, discount_worthwhile,
+            batch.importances > 0.8, batch.days_until_due <= 5,
+            float(cash_position), float(self.min_cash_buffer)
+        )
+        
+        # Delayed payments are pushed back 1-10 days depending on supplier importance
+        delay_days = np.minimum(10, np.maximum(1, (30 * (1 - batch.importances)).astype(np.int64)))
+        payment_dates = np.select(
+            [
+                payment_types == PaymentType.EARLY_WITH_DISCOUNT,
+                payment_types == PaymentType.EARLY_IMPORTANT_SUPPLIER,
+                payment_types == PaymentType.DELAYED_CASH_CONSTRAINT
+            ],
+            [batch.discount_dates, np.full(batch.n, today), batch.due_dates + delay_days],
+            default=batch.due_dates
+        )
+        
+        # Convert the columns to lists once, formatting all dates and payment types at once
+        payment_type_labels = [payment_type.name.lower() for payment_type in PaymentType]
+        columns = zip(
+            batch.ids.tolist(),
+            batch.counterparty_ids.tolist(),
+            batch.amounts.tolist(),
+            payment_amounts.tolist(),
+            np.datetime_as_string(batch.due_dates, unit='D').tolist(),
+            np.datetime_as_string(payment_dates, unit='D').tolist(),
+            [payment_type_labels[t] for t in payment_types.tolist()],
+            batch.priorities.tolist(),
+            discount_amounts.tolist()
+        )
+        
+        # Create payment schedule
+        payment_schedule = [
+            {
+                'invoice_id': invoice_id,
                 'supplier_id': supplier_id,
                 'amount': amount,
                 'payment_amount': payment_amount,
-                'due_date': due_date.strftime('%Y-%m-%d'),
-                'payment_date': payment_date.strftime('%Y-%m-%d'),
+                'due_date': due_date,
+                'payment_date': payment_date,
                 'payment_type': payment_type,
                 'priority': priority,
-                'discount_amount': discount_amount if has_discount else 0
-            })
+                'discount_amount': discount_amount
+            }
+            for (invoice_id, supplier_id, amount, payment_amount, due_date,
+                 payment_date, payment_type, priority, discount_amount) in columns
+        ]
         
         # Calculate metrics
-        total_payable = sum(inv['invoice']['amount'] for inv in prioritized_invoices)
-        total_discount = sum(payment['discount_amount'] for payment in payment_schedule)
-        on_time_payments = sum(1 for payment in payment_schedule 
-                              if payment['payment_type'] != 'delayed_cash_constraint')
-        on_time_percentage = (on_time_payments / len(payment_schedule)) * 100 if payment_schedule else 0
+        on_time = payment_types != PaymentType.DELAYED_CASH_CONSTRAINT
+        total_payable = float(batch.amounts.sum())
+        total_discount = float(discount_amounts.sum())
+        on_time_percentage = float(on_time.mean()) * 100 if batch.n else 0
         
         return {
             'payment_schedule': payment_schedule,
@@ -182,84 +175,94 @@ class AccountsPayableOptimizer:
             }
         }
     
-    def _prioritize_invoices(self, invoices):
+    def per_supplier_metrics(self, payment_schedule):
+        """Aggregate a payment schedule per supplier
+        
+        Args:
+            payment_schedule (list): Payment schedule returned by optimize_payment_schedule
+            
+        Returns:
+            dict: Total payable, total paid and discount captured by supplier ID,
+                for invoices with a known supplier
+        """
+        payments = [payment for payment in payment_schedule if payment['supplier_id'] is not None]
+        supplier_ids = np.array([payment['supplier_id'] for payment in payments], dtype=str)
+        values = np.array(
+            [[payment['amount'], payment['payment_amount'], payment['discount_amount']] for payment in payments],
+            dtype=np.float64
+        ).reshape(-1, 3)
+        
+        suppliers, totals = grouped_sums(supplier_ids, values)
+        return {
+            supplier_id: {
+                'total_payable': total_payable,
+                'total_paid': total_paid,
+                'total_discount_captured': total_discount
+            }
+            for supplier_id, (total_payable, total_paid, total_discount) in zip(suppliers.tolist(), totals.tolist())
+        }
+    
+    def _prioritize_invoices(self, invoices, top_k=None, today=None):
         """Prioritize invoices based on due date, discount availability, and supplier importance
         
         Args:
             invoices (list): List of invoices
+            top_k (int, optional): Only return the top_k highest priority invoices
+            today (datetime.date, optional): Current date, defaults to today
             
         Returns:
-            list: Prioritized list of invoices with priority scores
+            PrioritizedBatch: Invoices in priority order with priority scores, parsed dates and supplier importance
         """
-        prioritized = []
+        invs = [invoice['i'] for invoice in invoices]
+        n = len(invs)
         
-        for invoice in invoices:
-            inv = invoice['i']
-            
-            # Get supplier ID
-            supplier_id = None
-            supplier_query = """
-            MATCH (s:Supplier)-[:HAS_INVOICE]->(i:Invoice {id: $invoice_id})
-            RETURN s.id AS supplier_id
-            """
-            supplier_result = self.neo4j_client.run_query(supplier_query, {"invoice_id": inv['id']})
-            if supplier_result:
-                supplier_id = supplier_result[0]['supplier_id']
-            
-            # Calculate base priority based on due date
-            due_date = datetime.strptime(inv['dueDate'], '%Y-%m-%d').date()
+        # The suppliers were joined in by the invoice query
+        supplier_ids = np.array([invoice['counterparty_id'] for invoice in invoices], dtype=object)
+        
+        # Calculate days until due
+        if today is None:
             today = datetime.now().date()
-            days_until_due = (due_date - today).days
-            
-            if days_until_due < 0:
-                # Overdue
-                base_priority = 100
-            elif days_until_due < 7:
-                # Due within a week
-                base_priority = 90
-            elif days_until_due < 14:
-                # Due within two weeks
-                base_priority = 80
-            elif days_until_due < 30:
-                # Due within a month
-                base_priority = 70
-            else:
-                # Due later
-                base_priority = 60
-            
-            # Adjust for discount availability
-            if 'earlyPaymentDate' in inv and 'discountRate' in inv:
-                discount_rate = inv['discountRate']
-                discount_date = datetime.strptime(inv['earlyPaymentDate'], '%Y-%m-%d').date()
-                days_until_discount = (discount_date - today).days
-                
-                if days_until_discount < 0:
-                    # Discount expired
-                    discount_priority = 0
-                elif days_until_discount < 7:
-                    # Discount expiring soon
-                    discount_priority = 20 * discount_rate * 100  # e.g., 2% discount = 40 points
-                else:
-                    # Discount available but not urgent
-                    discount_priority = 10 * discount_rate * 100
-                    
-                base_priority += discount_priority
-            
-            # Adjust for supplier importance
-            importance = self.supplier_importance.get(supplier_id, 0.5)
-            importance_priority = importance * 20  # 0-20 points
-            
-            # Calculate final priority
-            final_priority = base_priority + importance_priority
-            
-            prioritized.append({
-                'invoice': inv,
-                'supplier_id': supplier_id,
-                'priority': final_priority,
-                'days_until_due': days_until_due
-            })
+        today = np.datetime64(today, 'D')
+        due_dates = pd.to_datetime([inv['dueDate'] for inv in invs], format='%Y-%m-%d').values.astype('datetime64[D]')
+        days_until_due = (due_dates - today).astype(np.int64)
+        
+        # Check discount availability
+        has_discount = np.fromiter(
+            (('earlyPaymentDate' in inv and 'discountRate' in inv) for inv in invs), dtype=bool, count=n
+        )
+        discount_rates = np.fromiter(
+            (inv['discountRate'] if has else 0.0 for inv, has in zip(invs, has_discount.tolist())),
+            dtype=np.float64, count=n
+        )
+        discount_dates = pd.to_datetime(
+            [inv['earlyPaymentDate'] if has else None for inv, has in zip(invs, has_discount.tolist())],
+            format='%Y-%m-%d'
+        ).values.astype('datetime64[D]')
+        days_until_discount = (discount_dates - today).astype(np.int64)
+        
+        # Look up supplier importance
+        importance_of = self.supplier_importance.get
+        importances = np.fromiter(
+            (importance_of(s, 0.5) for s in supplier_ids.tolist()), dtype=np.float64, count=n
+        )
+        
+        # Calculate priority from due date, discount availability and supplier importance
+        priorities = payable_priority(
+            days_until_due, discount_rates, importances, days_until_discount, has_discount
+        )
         
-        # Sort by priority (highest first)
-        prioritized.sort(key=lambda x: x['priority'], reverse=True)
+        batch = PrioritizedBatch(
+            ids=np.array([inv['id'] for inv in invs], dtype=object),
+            counterparty_ids=supplier_ids,
+            amounts=np.fromiter((inv['amount'] for inv in invs), dtype=np.float64, count=n),
+            due_dates=due_dates,
+            days_until_due=days_until_due,
+            importances=importances,
+            priorities=priorities,
+            has_discount=has_discount,
+            discount_rates=discount_rates,
+            discount_dates=discount_dates
+        )
         
-        return prioritized
+        # Sort by priority (highest first), keeping the input order for ties
+        return batch.take(priority_order(priorities, top_k))
@@ -5,10 +5,28 @@ Implements the mathematical model for AR optimization
 import logging
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime
+from models.query_cache import QueryCache
+from models.prioritized_batch import PrioritizedBatch
+from models.kernels import CollectionAction, TIMING_LABELS, NO_ACTION, grouped_sums, priority_order, score_collection_actions
 
 logger = logging.getLogger(__name__)
 
+# Days each collection action is expected to bring a payment forward
+_DAYS_REDUCTION = {
+    'reminder_email': 2,
+    'phone_call': 5,
+    'personal_visit': 10,
+    'early_payment_discount': 15,
+    'late_payment_penalty': 3,
+    'collection_agency': 20
+}
+
+# Days reduction by action code, the trailing zero is picked up by NO_ACTION (-1)
+_DAYS_REDUCTION_BY_CODE = np.array(
+    [_DAYS_REDUCTION[action.name.lower()] for action in CollectionAction] + [0], dtype=np.int64
+)
+
 class AccountsReceivableOptimizer:
     """
     Accounts Receivable Optimization model that determines optimal collection strategies
@@ -25,6 +43,10 @@ class AccountsReceivableOptimizer:
         self.horizon_days = 90
         self.borrowing_rate = 0.0001  # Daily borrowing rate
         self.customer_importance = {}  # Dictionary of customer importance scores
+        self.query_cache = QueryCache(maxsize=256, ttl=60)
+        
+        # Drop cached query results whenever the database is written to
+        neo4j_client.add_write_listener(self.invalidate_cache)
         self.collection_actions = {
             'reminder_email': {
                 'cost': 1,
@@ -58,6 +80,12 @@ class AccountsReceivableOptimizer:
             }
         }
         
+        # Cost, effectiveness and relationship impact of each action, unpacked once
+        self._action_static = {
+            action: (values['cost'], values['effectiveness'], values['relationship_impact'])
+            for action, values in self.collection_actions.items()
+        }
+        
     def set_customer_importance(self, customer_id, importance_score):
         """Set the importance score for a customer
         
@@ -71,38 +99,54 @@ class AccountsReceivableOptimizer:
         self.customer_importance[customer_id] = importance_score
         logger.info(f"Set importance score for customer {customer_id} to {importance_score}")
         
-    def get_receivable_invoices(self):
+    def invalidate_cache(self):
+        """Drop cached invoice lookups"""
+        self.query_cache.clear()
+        
+    def get_receivable_invoices(self, today=None):
         """Get all receivable invoices within the optimization horizon
         
+        Args:
+            today (datetime.date, optional): Current date, defaults to today
+            
         Returns:
-            list: List of receivable invoices
+            list: List of receivable invoices with their customer IDs
         """
-        return self.neo4j_client.get_invoices_by_type('AR', self.horizon_days)
+        if today is None:
+            today = datetime.now().date()
+            
+        # The query is relative to today, so results are only reused within the day
+        key = ('invoices', self.horizon_days, today)
+        return self.query_cache.get_or_load(
+            key,
+            lambda: self.neo4j_client.get_invoices_by_type('AR', self.horizon_days, include_counterparty=True)
+        )
         
-    def optimize_collection_strategy(self, cash_position, cash_forecast=None, objective='balanced'):
+    def optimize_collection_strategy(self, cash_position, cash_forecast=None, objective='balanced', top_k=None):
         """Optimize the collection strategy for accounts receivable
         
         Args:
             cash_position (float): Current cash position
             cash_forecast (pd.DataFrame, optional): Cash flow forecast
             objective (str): Optimization objective - 'cash_flow', 'relationship', or 'balanced'
+            top_k (int, optional): Only plan collection of the top_k highest priority invoices
             
         Returns:
             dict: Optimized collection strategy
         """
         logger.info(f"Optimizing accounts receivable collection strategy with objective: {objective}")
         
+        # Use the same date throughout the run
+        today = datetime.now().date()
+        
         # Get receivable invoices
-        invoices = self.get_receivable_invoices()
+        invoices = self.get_receivable_invoices(today)
         
         # If no cash forecast provided, get it from the database
         if cash_forecast is None:
             forecast_data = self.neo4j_client.get_cash_flow_forecast(self.horizon_days)
             cash_forecast = pd.DataFrame(forecast_data)
             
-        # Create collection strategy
-        collection_strategy = []
-        
         # Set objective weights based on selected objective
         if objective == 'cash_flow':
             weights = {
@@ -124,55 +168,49 @@ class AccountsReceivableOptimizer:
             }
         
         # Prioritize invoices
-        prioritized_invoices = self._prioritize_invoices(invoices, cash_position, cash_forecast)
-        
-        # Process each invoice
-        for invoice in prioritized_invoices:
-            inv = invoice['invoice']
-            priority = invoice['priority']
-            customer_id = invoice['customer_id']
-            days_overdue = invoice['days_overdue']
-            
-            # Get invoice details
-            amount = inv['amount']
-            due_date = datetime.strptime(inv['dueDate'], '%Y-%m-%d').date()
-            today = datetime.now().date()
-            
-            # Determine optimal collection actions based on invoice characteristics
-            optimal_actions = self._determine_optimal_actions(
-                amount, due_date, days_overdue, customer_id, priority, weights
-            )
-            
-            # Calculate expected benefit
-            expected_collection_date = self._calculate_expected_collection_date(
-                due_date, optimal_actions
-            )
-            
-            # Calculate financial impact
-            financial_impact = self._calculate_financial_impact(
-                amount, due_date, expected_collection_date
-            )
-            
-            # Add to collection strategy
-            collection_strategy.append({
-                'invoice_id': inv['id'],
+        batch = self._prioritize_invoices(invoices, cash_position, cash_forecast, top_k, today)
+        
+        # Determine optimal collection actions for all invoices at once
+        actions_by_invoice, action_codes, action_costs = self._determine_optimal_actions(batch, weights)
+        
+        # Calculate expected collection dates and financial impacts for all invoices
+        expected_dates = self._calculate_expected_collection_dates(batch.due_dates, action_codes, today)
+        financial_impacts = self._calculate_financial_impacts(batch.amounts, batch.due_dates, expected_dates)
+        
+        # Convert the columns to lists once, formatting all dates at once
+        columns = zip(
+            batch.ids.tolist(),
+            batch.counterparty_ids.tolist(),
+            batch.amounts.tolist(),
+            np.datetime_as_string(batch.due_dates, unit='D').tolist(),
+            (-batch.days_until_due).tolist(),
+            batch.priorities.tolist(),
+            actions_by_invoice,
+            np.datetime_as_string(expected_dates, unit='D').tolist(),
+            financial_impacts.tolist()
+        )
+        
+        # Create collection strategy
+        collection_strategy = [
+            {
+                'invoice_id': invoice_id,
                 'customer_id': customer_id,
                 'amount': amount,
-                'due_date': due_date.strftime('%Y-%m-%d'),
+                'due_date': due_date,
                 'days_overdue': days_overdue,
                 'priority': priority,
-                'actions': optimal_actions,
-                'expected_collection_date': expected_collection_date.strftime('%Y-%m-%d'),
+                'actions': actions,
+                'expected_collection_date': expected_collection_date,
                 'financial_impact': financial_impact
-            })
+            }
+            for (invoice_id, customer_id, amount, due_date, days_overdue,
+                 priority, actions, expected_collection_date, financial_impact) in columns
+        ]
         
         # Calculate metrics
-        total_receivable = sum(inv['invoice']['amount'] for inv in prioritized_invoices)
-        total_actions_cost = sum(
-            sum(action['cost'] for action in strategy['actions'])
-            for strategy in collection_strategy
-        )
-        total_financial_impact = sum(strategy['financial_impact'] for strategy in collection_strategy)
+        total_receivable = float(batch.amounts.sum())
+        total_actions_cost = float(action_costs.sum())
+        total_financial_impact = float(financial_impacts.sum())
         
         return {
             'collection_strategy': collection_strategy,
@@ -184,258 +222,191 @@ class AccountsReceivableOptimizer:
             }
         }
     
-    def _prioritize_invoices(self, invoices, cash_position, cash_forecast):
+    def per_customer_metrics(self, collection_strategy):
+        """Aggregate a collection strategy per customer
+        
+        Args:
+            collection_strategy (list): Collection strategy returned by optimize_collection_strategy
+            
+        Returns:
+            dict: Total receivable, actions cost and financial impact by customer ID,
+                for invoices with a known customer
+        """
+        strategies = [strategy for strategy in collection_strategy if strategy['customer_id'] is not None]
+        customer_ids = np.array([strategy['customer_id'] for strategy in strategies], dtype=str)
+        values = np.array(
+            [
+                [
+                    strategy['amount'],
+                    sum(action['cost'] for action in strategy['actions']),
+                    strategy['financial_impact']
+                ]
+                for strategy in strategies
+            ],
+            dtype=np.float64
+        ).reshape(-1, 3)
+        
+        customers, totals = grouped_sums(customer_ids, values)
+        return {
+            customer_id: {
+                'total_receivable': total_receivable,
+                'total_actions_cost': total_actions_cost,
+                'total_financial_impact': total_impact
+            }
+            for customer_id, (total_receivable, total_actions_cost, total_impact) in zip(customers.tolist(), totals.tolist())
+        }
+    
+    def _prioritize_invoices(self, invoices, cash_position, cash_forecast, top_k=None, today=None):
         """Prioritize invoices based on due date, amount, and customer importance
         
         Args:
             invoices (list): List of invoices
             cash_position (float): Current cash position
             cash_forecast (pd.DataFrame): Cash flow forecast
+            top_k (int, optional): Only return the top_k highest priority invoices
+            today (datetime.date, optional): Current date, defaults to today
             
         Returns:
-            list: Prioritized list of invoices with priority scores
+            PrioritizedBatch: Invoices in priority order with priority scores, parsed due dates and customer importance
         """
-        prioritized = []
+        invs = [invoice['i'] for invoice in invoices]
+        n = len(invs)
         
-        for invoice in invoices:
-            inv = invoice['i']
-            
-            # Get customer ID
-            customer_id = None
-            customer_query = """
-            MATCH (c:Customer)-[:HAS_INVOICE]->(i:Invoice {id: $invoice_id})
-            RETURN c.id AS customer_id
-            """
-            customer_result = self.neo4j_client.run_query(customer_query, {"invoice_id": inv['id']})
-            if customer_result:
-                customer_id = customer_result[0]['customer_id']
-            
-            # Calculate days overdue
-            due_date = datetime.strptime(inv['dueDate'], '%Y-%m-%d').date()
+        # The customers were joined in by the invoice query
+        customer_ids = np.array([invoice['counterparty_id'] for invoice in invoices], dtype=object)
+        
+        # Calculate days overdue
+        if today is None:
             today = datetime.now().date()
-            days_overdue = (today - due_date).days
-            
-            # Calculate base priority based on days overdue
-            if days_overdue > 90:
-                # Severely overdue
-                base_priority = 100
-            elif days_overdue > 60:
-                # Very overdue
-                base_priority = 90
-            elif days_overdue > 30:
-                # Moderately overdue
-                base_priority = 80
-            elif days_overdue > 0:
-                # Slightly overdue
-                base_priority = 70
-            elif (due_date - today).days < 7:
-                # Due within a week
-                base_priority = 60
-            elif (due_date - today).days < 14:
-                # Due within two weeks
-                base_priority = 50
-            else:
-                # Due later
-                base_priority = 40
-            
-            # Adjust for amount (higher amounts get higher priority)
-            amount = inv['amount']
-            amount_factor = min(20, amount / 5000)  # Max 20 points for amounts >= $100,000
-            
-            # Adjust for customer importance (inversely - less important customers get higher collection priority)
-            importance = self.customer_importance.get(customer_id, 0.5)
-            importance_factor = (1 - importance) * 20  # 0-20 points
-            
-            # Calculate final priority
-            final_priority = base_priority + amount_factor + importance_factor
-            
-            prioritized.append({
-                'invoice': inv,
-                'customer_id': customer_id,
-                'priority': final_priority,
-                'days_overdue': days_overdue
-            })
+        today = np.datetime64(today, 'D')
+        due_dates = pd.to_datetime([inv['dueDate'] for inv in invs], format='%Y-%m-%d').values.astype('datetime64[D]')
+        days_overdue = (today - due_dates).astype(np.int64)
+        
+        # Calculate base priority based on days overdue
+        base_priority = np.select(
+            [
+                days_overdue > 90,  # Severely overdue
+                days_overdue > 60,  # Very overdue
+                days_overdue > 30,  # Moderately overdue
+                days_overdue > 0,  # Slightly overdue
+                -days_overdue < 7,  # Due within a week
+                -days_overdue < 14  # Due within two weeks
+            ],
+            [100, 90, 80, 70, 60, 50],
+            default=40  # Due later
+        )
+        
+        # Adjust for amount (higher amounts get higher priority)
+        amounts = np.fromiter((inv['amount'] for inv in invs), dtype=np.float64, count=n)
+        amount_factor = np.minimum(20, amounts / 5000)  # Max 20 points for amounts >= $100,000
+        
+        # Adjust for customer importance (inversely - less important customers get higher collection priority)
+        importance_of = self.customer_importance.get
+        importances = np.fromiter(
+            (importance_of(c, 0.5) for c in customer_ids.tolist()), dtype=np.float64, count=n
+        )
+        importance_factor = (1 - importances) * 20  # 0-20 points
         
-        # Sort by priority (highest first)
-        prioritized.sort(key=lambda x: x['priority'], reverse=True)
+        # Calculate final priority
+        priorities = base_priority + amount_factor + importance_factor
         
-        return prioritized
+        batch = PrioritizedBatch(
+            ids=np.array([inv['id'] for inv in invs], dtype=object),
+            counterparty_ids=customer_ids,
+            amounts=amounts,
+            due_dates=due_dates,
+            days_until_due=-days_overdue,
+            importances=importances,
+            priorities=priorities
+        )
+        
+        # Sort by priority (highest first), keeping the input order for ties
+        return batch.take(priority_order(priorities, top_k))
     
-    def _determine_optimal_actions(self, amount, due_date, days_overdue, customer_id, priority, weights):
-        """Determine optimal collection actions for an invoice
+    def _determine_optimal_actions(self, batch, weights):
+        """Determine optimal collection actions for each invoice
         
         Args:
-            amount (float): Invoice amount
-            due_date (datetime.date): Invoice due date
-            days_overdue (int): Days the invoice is overdue
-            customer_id (str): Customer ID
-            priority (float): Invoice priority
+            batch (PrioritizedBatch): Prioritized invoices
             weights (dict): Objective weights
             
         Returns:
-            list: Optimal collection actions
+            tuple: Optimal collection actions of each invoice, and their action
+                codes and costs as (invoices, MAX_ACTIONS) arrays
         """
-        today = datetime.now().date()
-        customer_importance = self.customer_importance.get(customer_id, 0.5)
-        actions = []
-        
-        # Determine actions based on overdue status
-        if days_overdue > 90:
-            # Severely overdue - consider collection agency for low importance customers
-            if customer_importance < 0.4:
-                actions.append({
-                    'type': 'collection_agency',
-                    'timing': 'immediately',
-                    'cost': amount * 0.25,  # 25% fee
-                    'expected_benefit': amount * 0.8 * self.collection_actions['collection_agency']['effectiveness'],
-                    'relationship_impact': self.collection_actions['collection_agency']['relationship_impact']
-                })
-            else:
-                # High importance customer - personal visit
-                actions.append({
-                    'type': 'personal_visit',
-                    'timing': 'immediately',
-                    'cost': self.collection_actions['personal_visit']['cost'],
-                    'expected_benefit': amount * self.collection_actions['personal_visit']['effectiveness'],
-                    'relationship_impact': self.collection_actions['personal_visit']['relationship_impact'] * customer_importance
-                })
-        elif days_overdue > 60:
-            # Very overdue - phone call and late payment penalty
-            actions.append({
-                'type': 'phone_call',
-                'timing': 'immediately',
-                'cost': self.collection_actions['phone_call']['cost'],
-                'expected_benefit': amount * self.collection_actions['phone_call']['effectiveness'],
-                'relationship_impact': self.collection_actions['phone_call']['relationship_impact'] * customer_importance
-            })
-            
-            # Only add late payment penalty for lower importance customers
-            if customer_importance < 0.7:
-                actions.append({
-                    'type': 'late_payment_penalty',
-                    'timing': 'immediately',
-                    'cost': 0,
-                    'expected_benefit': amount * 0.02 * 30,  # 2% per month for 1 month
-                    'relationship_impact': self.collection_actions['late_payment_penalty']['relationship_impact'] * customer_importance
-                })
-        elif days_overdue > 30:
-            # Moderately overdue - reminder and phone call
-            actions.append({
-                'type': 'reminder_email',
-                'timing': 'immediately',
-                'cost': self.collection_actions['reminder_email']['cost'],
-                'expected_benefit': amount * self.collection_actions['reminder_email']['effectiveness'],
-                'relationship_impact': self.collection_actions['reminder_email']['relationship_impact'] * customer_importance
-            })
-            
-            actions.append({
-                'type': 'phone_call',
-                'timing': '3_days_after_reminder',
-                'cost': self.collection_actions['phone_call']['cost'],
-                'expected_benefit': amount * self.collection_actions['phone_call']['effectiveness'],
-                'relationship_impact': self.collection_actions['phone_call']['relationship_impact'] * customer_importance
-            })
-        elif days_overdue > 0:
-            # Slightly overdue - reminder email
-            actions.append({
-                'type': 'reminder_email',
-                'timing': 'immediately',
-                'cost': self.collection_actions['reminder_email']['cost'],
-                'expected_benefit': amount * self.collection_actions['reminder_email']['effectiveness'],
-                'relationship_impact': self.collection_actions['reminder_email']['relationship_impact'] * customer_importance
-            })
-        elif (due_date - today).days < 7:
-            # Due within a week - courtesy reminder
-            actions.append({
-                'type': 'reminder_email',
-                'timing': 'immediately',
-                'cost': self.collection_actions['reminder_email']['cost'],
-                'expected_benefit': amount * 0.2,  # Lower expectation for pre-due reminders
-                'relationship_impact': -0.05  # Very slight negative impact
-            })
-        elif priority > 70 and amount > 10000:
-            # High priority, large amount, not yet due - early payment discount
-            actions.append({
-                'type': 'early_payment_discount',
-                'timing': 'offer_immediately',
-                'cost': amount * 0.01,  # 1% discount
-                'expected_benefit': amount * 0.99 * self.collection_actions['early_payment_discount']['effectiveness'],
-                'relationship_impact': self.collection_actions['early_payment_discount']['relationship_impact']
-            })
-        
-        # Calculate scores for each action based on weights
-        for action in actions:
-            action['score'] = (
-                weights['cash_acceleration'] * action['expected_benefit'] +
-                weights['relationship'] * action['relationship_impact'] * 1000 +
-                weights['cost'] * -action['cost']
-            )
-        
-        # Sort actions by score (highest first)
-        actions.sort(key=lambda x: x['score'], reverse=True)
-        
-        return actions
+        weight_array = np.array(
+            [weights['cash_acceleration'], weights['relationship'], weights['cost']], dtype=np.float64
+        )
+        action_types = [action.name.lower() for action in CollectionAction]
+        action_static = np.array([self._action_static[action] for action in action_types], dtype=np.float64)
+        
+        codes, timings, costs, benefits, impacts, scores = score_collection_actions(
+            batch.amounts, -batch.days_until_due, batch.importances, batch.priorities, weight_array, action_static
+        )
+        
+        # Convert the chosen actions back to dicts, already sorted by score (highest first)
+        rows = zip(
+            codes.tolist(), timings.tolist(), costs.tolist(),
+            benefits.tolist(), impacts.tolist(), scores.tolist()
+        )
+        actions_by_invoice = [
+            [
+                {
+                    'type': action_types[code[slot]],
+                    'timing': TIMING_LABELS[timing[slot]],
+                    'cost': cost[slot],
+                    'expected_benefit': benefit[slot],
+                    'relationship_impact': impact[slot],
+                    'score': score[slot]
+                }
+                for slot in range(len(code))
+                if code[slot] != NO_ACTION
+            ]
+            for code, timing, cost, benefit, impact, score in rows
+        ]
+        return actions_by_invoice, codes, costs
     
-    def _calculate_expected_collection_date(self, due_date, actions):
-        """Calculate the expected collection date based on actions
+    def _calculate_expected_collection_dates(self, due_dates, action_codes, today=None):
+        """Calculate the expected collection dates based on actions
         
         Args:
-            due_date (datetime.date): Invoice due date
-            actions (list): Collection actions
+            due_dates (np.ndarray): Invoice due dates as datetime64[D]
+            action_codes (np.ndarray): Collection action codes of each invoice
+            today (datetime.date, optional): Current date, defaults to today
             
         Returns:
-            datetime.date: Expected collection date
+            np.ndarray: Expected collection dates as datetime64[D]
         """
-        today = datetime.now().date()
-        
-        # Base case - if no actions, expect payment on due date
-        if not actions:
-            return max(today, due_date)
+        if today is None:
+            today = datetime.now().date()
+        today = np.datetime64(today, 'D')
         
         # Calculate days reduction based on actions
-        days_reduction = 0
-        for action in actions:
-            if action['type'] == 'reminder_email':
-                days_reduction += 2
-            elif action['type'] == 'phone_call':
-                days_reduction += 5
-            elif action['type'] == 'personal_visit':
-                days_reduction += 10
-            elif action['type'] == 'early_payment_discount':
-                days_reduction += 15
-            elif action['type'] == 'late_payment_penalty':
-                days_reduction += 3
-            elif action['type'] == 'collection_agency':
-                days_reduction += 20
-        
-        # If already overdue, calculate from today
-        if due_date < today:
-            # Estimate collection in days_reduction days, but at least 1 day
-            return today + timedelta(days=max(1, 30 - days_reduction))
-        else:
-            # Estimate collection days_reduction days before due date, but not before today
-            expected_date = due_date - timedelta(days=days_reduction)
-            return max(today, expected_date)
+        days_reduction = _DAYS_REDUCTION_BY_CODE[action_codes].sum(axis=1)
+        has_actions = action_codes[:, 0] != NO_ACTION
+        
+        return np.where(
+            due_dates < today,
+            # If already overdue, estimate collection in 30 - days_reduction days
+            # (at least 1 day) from today, or today if there are no actions
+            np.where(has_actions, today + np.maximum(1, 30 - days_reduction), today),
+            # Otherwise estimate collection days_reduction days before due date, but not before today
+            np.maximum(today, due_dates - days_reduction)
+        )
     
-    def _calculate_financial_impact(self, amount, due_date, expected_collection_date):
+    def _calculate_financial_impacts(self, amounts, due_dates, expected_collection_dates):
         """Calculate the financial impact of accelerated collection
         
         Args:
-            amount (float): Invoice amount
-            due_date (datetime.date): Invoice due date
-            expected_collection_date (datetime.date): Expected collection date
+            amounts (np.ndarray): Invoice amounts
+            due_dates (np.ndarray): Invoice due dates as datetime64[D]
+            expected_collection_dates (np.ndarray): Expected collection dates as datetime64[D]
             
         Returns:
-            float: Financial impact (positive for benefit)
+            np.ndarray: Financial impacts (positive for benefit)
         """
-        # If collection is expected after due date, no acceleration benefit
-        if expected_collection_date >= due_date:
-            return 0
-        
-        # Calculate days of acceleration
-        days_accelerated = (due_date - expected_collection_date).days
+        # Collection expected after due date has no acceleration benefit
+        days_accelerated = np.maximum(0, (due_dates - expected_collection_dates).astype(np.int64))
         
         # Calculate financing benefit (avoided borrowing cost)
-        financing_benefit = amount * self.borrowing_rate * days_accelerated
-        
-        return financing_benefit
+        return amounts * self.borrowing_rate * days_accelerated
@@ -0,0 +1,379 @@
+"""
+Numerical Kernels for Finance MCP Application
+Numba-compiled kernels for the per-invoice optimizer math
+"""
+from enum import IntEnum
+import numpy as np
+from numba import guvectorize, njit
+
+class CollectionAction(IntEnum):
+    """Collection action types, named like the keys of the optimizer's collection actions"""
+    REMINDER_EMAIL = 0
+    PHONE_CALL = 1
+    PERSONAL_VISIT = 2
+    EARLY_PAYMENT_DISCOUNT = 3
+    LATE_PAYMENT_PENALTY = 4
+    COLLECTION_AGENCY = 5
+
+class ActionTiming(IntEnum):
+    """When a collection action is taken"""
+    IMMEDIATELY = 0
+    THREE_DAYS_AFTER_REMINDER = 1
+    OFFER_IMMEDIATELY = 2
+
+class PaymentType(IntEnum):
+    """How an invoice is paid, named like the payment types of the payment schedule"""
+    EARLY_WITH_DISCOUNT = 0
+    ON_DUE_DATE = 1
+    EARLY_IMPORTANT_SUPPLIER = 2
+    DELAYED_CASH_CONSTRAINT = 3
+
+class PayableRecommendation(IntEnum):
+    """Working capital recommendation for a payable invoice"""
+    DELAY = 0
+    PAY_EARLY = 1
+    PAY_ON_TIME_FOR_CASH = 2  # Discount available but not worth paying early for
+    PAY_ON_TIME_FOR_RELATIONSHIP = 3  # No discount available
+
+class ReceivableRecommendation(IntEnum):
+    """Working capital recommendation for a receivable invoice"""
+    ACCELERATE = 0
+    STANDARD = 1
+    STANDARD_LARGE = 2  # Standard collection with an extra call for a large amount
+
+# Marks an invoice whose due date is outside the forecast
+NOT_IN_FORECAST = -1
+
+# Timing labels by ActionTiming
+TIMING_LABELS = ('immediately', '3_days_after_reminder', 'offer_immediately')
+
+# Marks an unused action slot
+NO_ACTION = -1
+
+# Maximum number of actions chosen for one invoice
+MAX_ACTIONS = 2
+
+# Columns of the action static array
+COST, EFFECTIVENESS, RELATIONSHIP_IMPACT = 0, 1, 2
+
+def priority_order(priorities, top_k=None):
+    """Order invoices by priority (highest first), keeping the input order for ties
+
+    Args:
+        priorities (np.ndarray): Invoice priorities
+        top_k (int, optional): Only return the top_k highest priority invoices
+
+    Returns:
+        np.ndarray: Indices of the invoices in priority order
+    """
+    if top_k is None or top_k >= len(priorities):
+        return np.argsort(-priorities, kind='stable')
+    if top_k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    # Find the top_k-th highest priority in linear time, take everything above
+    # it and fill up with the earliest invoices tied with it, so the result is
+    # the same prefix the full stable order would give
+    kth = np.partition(-priorities, top_k - 1)[top_k - 1]
+    above = np.flatnonzero(-priorities < kth)
+    tied = np.flatnonzero(-priorities == kth)[:top_k - len(above)]
+    top = np.sort(np.concatenate([above, tied]))
+    return top[np.argsort(-priorities[top], kind='stable')]
+
+def grouped_sums(keys, values):
+    """Sum rows of values per key, grouping by sorting rather than hashing
+
+    Args:
+        keys (np.ndarray): Group key of each row
+        values (np.ndarray): Values to sum, one row per key
+
+    Returns:
+        tuple: Unique keys in sorted order, and the summed values of each key
+    """
+    order = np.argsort(keys, kind='stable')
+    unique_keys, starts = np.unique(keys[order], return_index=True)
+    if len(unique_keys) == 0:
+        return unique_keys, np.zeros((0,) + values.shape[1:], dtype=values.dtype)
+    return unique_keys, np.add.reduceat(values[order], starts, axis=0)
+
+@njit(cache=True)
+def _set_action(i, slot, code, timing, cost, benefit, impact,
+                codes, timings, costs, benefits, impacts):
+    """Store one chosen action of invoice i"""
+    codes[i, slot] = code
+    timings[i, slot] = timing
+    costs[i, slot] = cost
+    benefits[i, slot] = benefit
+    impacts[i, slot] = impact
+
+@njit(cache=True)
+def score_collection_actions(amounts, days_overdue, importances, priorities, weights, action_static):
+    """Choose and score collection actions for each invoice
+
+    Args:
+        amounts (np.ndarray): Invoice amounts
+        days_overdue (np.ndarray): Days each invoice is overdue, negative if not yet due
+        importances (np.ndarray): Customer importance of each invoice
+        priorities (np.ndarray): Invoice priorities
+        weights (np.ndarray): Cash acceleration, relationship and cost objective weights
+        action_static (np.ndarray): Cost, effectiveness and relationship impact of each
+            CollectionAction, one row per action
+
+    Returns:
+        tuple: Action codes and timings, each (n, MAX_ACTIONS) with NO_ACTION for
+            unused slots, and the matching costs, expected benefits, relationship
+            impacts and scores, with each invoice's actions sorted by score (highest first)
+    """
+    n = amounts.shape[0]
+    codes = np.full((n, MAX_ACTIONS), NO_ACTION, dtype=np.int64)
+    timings = np.zeros((n, MAX_ACTIONS), dtype=np.int64)
+    costs = np.zeros((n, MAX_ACTIONS))
+    benefits = np.zeros((n, MAX_ACTIONS))
+    impacts = np.zeros((n, MAX_ACTIONS))
+    scores = np.zeros((n, MAX_ACTIONS))
+
+    reminder = action_static[CollectionAction.REMINDER_EMAIL]
+    phone = action_static[CollectionAction.PHONE_CALL]
+    visit = action_static[CollectionAction.PERSONAL_VISIT]
+    discount = action_static[CollectionAction.EARLY_PAYMENT_DISCOUNT]
+    penalty = action_static[CollectionAction.LATE_PAYMENT_PENALTY]
+    agency = action_static[CollectionAction.COLLECTION_AGENCY]
+
+    for i in range(n):
+        amount = amounts[i]
+        days = days_overdue[i]
+        importance = importances[i]
+
+        if days > 90:
+            # Severely overdue - collection agency for low importance customers,
+            # personal visit for high importance customers
+            if importance < 0.4:
+                _set_action(i, 0, CollectionAction.COLLECTION_AGENCY, ActionTiming.IMMEDIATELY,
+                            amount * 0.25,  # 25% fee
+                            amount * 0.8 * agency[EFFECTIVENESS], agency[RELATIONSHIP_IMPACT],
+                            codes, timings, costs, benefits, impacts)
+            else:
+                _set_action(i, 0, CollectionAction.PERSONAL_VISIT, ActionTiming.IMMEDIATELY, visit[COST],
+                            amount * visit[EFFECTIVENESS], visit[RELATIONSHIP_IMPACT] * importance,
+                            codes, timings, costs, benefits, impacts)
+        elif days > 60:
+            # Very overdue - phone call, and late payment penalty for lower importance customers
+            _set_action(i, 0, CollectionAction.PHONE_CALL, ActionTiming.IMMEDIATELY, phone[COST],
+                        amount * phone[EFFECTIVENESS], phone[RELATIONSHIP_IMPACT] * importance,
+                        codes, timings, costs, benefits, impacts)
+            if importance < 0.7:
+                _set_action(i, 1, CollectionAction.LATE_PAYMENT_PENALTY, ActionTiming.IMMEDIATELY, 0.0,
+                            amount * 0.02 * 30,  # 2% per month for 1 month
+                            penalty[RELATIONSHIP_IMPACT] * importance,
+                            codes, timings, costs, benefits, impacts)
+        elif days > 30:
+            # Moderately overdue - reminder and phone call
+            _set_action(i, 0, CollectionAction.REMINDER_EMAIL, ActionTiming.IMMEDIATELY, reminder[COST],
+                        amount * reminder[EFFECTIVENESS], reminder[RELATIONSHIP_IMPACT] * importance,
+                        codes, timings, costs, benefits, impacts)
+            _set_action(i, 1, CollectionAction.PHONE_CALL, ActionTiming.THREE_DAYS_AFTER_REMINDER, phone[COST],
+                        amount * phone[EFFECTIVENESS], phone[RELATIONSHIP_IMPACT] * importance,
+                        codes, timings, costs, benefits, impacts)
+        elif days > 0:
+            # Slightly overdue - reminder email
+            _set_action(i, 0, CollectionAction.REMINDER_EMAIL, ActionTiming.IMMEDIATELY, reminder[COST],
+                        amount * reminder[EFFECTIVENESS], reminder[RELATIONSHIP_IMPACT] * importance,
+                        codes, timings, costs, benefits, impacts)
+        elif -days < 7:
+            # Due within a week - courtesy reminder with a lower expectation
+            # and a very slight negative impact
+            _set_action(i, 0, CollectionAction.REMINDER_EMAIL, ActionTiming.IMMEDIATELY,
+                        reminder[COST], amount * 0.2, -0.05,
+                        codes, timings, costs, benefits, impacts)
+        elif priorities[i] > 70 and amount > 10000:
+            # High priority, large amount, not yet due - early payment discount
+            _set_action(i, 0, CollectionAction.EARLY_PAYMENT_DISCOUNT, ActionTiming.OFFER_IMMEDIATELY,
+                        amount * 0.01,  # 1% discount
+                        amount * 0.99 * discount[EFFECTIVENESS], discount[RELATIONSHIP_IMPACT],
+                        codes, timings, costs, benefits, impacts)
+
+        # Calculate scores for each action based on weights
+        for slot in range(MAX_ACTIONS):
+            if codes[i, slot] != NO_ACTION:
+                scores[i, slot] = (
+                    weights[0] * benefits[i, slot] +
+                    weights[1] * impacts[i, slot] * 1000 +
+                    weights[2] * -costs[i, slot]
+                )
+
+        # Sort actions by score (highest first), keeping their order on ties
+        if codes[i, 1] != NO_ACTION and scores[i, 1] > scores[i, 0]:
+            for arr in (costs, benefits, impacts, scores):
+                arr[i, 0], arr[i, 1] = arr[i, 1], arr[i, 0]
+            for arr in (codes, timings):
+                arr[i, 0], arr[i, 1] = arr[i, 1], arr[i, 0]
+
+    return codes, timings, costs, benefits, impacts, scores
+
+@njit(cache=True)
+def allocate_payments(amounts, discount_amounts, has_discount, discount_worthwhile,
+                      important, due_soon, cash_position, min_cash_buffer):
+    """Decide how to pay each invoice in priority order from the available cash
+
+    Each decision depends on the cash left after the payments before it, and
+    delayed payments don't use any cash, so this is a sequential scan.
+
+    Args:
+        amounts (np.ndarray): Invoice amounts, in priority order
+        discount_amounts (np.ndarray): Early payment discount of each invoice
+        has_discount (np.ndarray): Whether an early payment discount is available
+        discount_worthwhile (np.ndarray): Whether the discount exceeds the cost of paying early
+        important (np.ndarray): Whether the supplier is of high importance
+        due_soon (np.ndarray): Whether the invoice is due within 5 days
+        cash_position (float): Current cash position
+        min_cash_buffer (float): Minimum cash buffer to maintain
+
+    Returns:
+        tuple: PaymentType and payment amount of each invoice, and the remaining cash
+    """
+    n = amounts.shape[0]
+    payment_types = np.empty(n, dtype=np.int64)
+    payment_amounts = np.empty(n)
+    remaining_cash = cash_position
+
+    for i in range(n):
+        amount = amounts[i]
+        payment_amounts[i] = amount
+
+        if has_discount[i]:
+            # Pay by discount date if worthwhile and affordable, otherwise on due date
+            if discount_worthwhile[i] and remaining_cash >= amount:
+                payment_types[i] = PaymentType.EARLY_WITH_DISCOUNT
+                payment_amounts[i] = amount - discount_amounts[i]
+            else:
+                payment_types[i] = PaymentType.ON_DUE_DATE
+            remaining_cash -= payment_amounts[i]
+        elif important[i]:
+            # High importance supplier - pay on time or early
+            if due_soon[i] and remaining_cash >= amount:
+                payment_types[i] = PaymentType.EARLY_IMPORTANT_SUPPLIER
+            else:
+                payment_types[i] = PaymentType.ON_DUE_DATE
+            remaining_cash -= amount
+        elif remaining_cash < min_cash_buffer + amount:
+            # Cash is tight - delay payment
+            payment_types[i] = PaymentType.DELAYED_CASH_CONSTRAINT
+        else:
+            # Normal payment on due date
+            payment_types[i] = PaymentType.ON_DUE_DATE
+            remaining_cash -= amount
+
+    return payment_types, payment_amounts, remaining_cash
+
+@guvectorize(
+    ['void(int64[:], float64[:], float64[:], int64[:], boolean[:], float64[:])'],
+    '(n),(n),(n),(n),(n)->(n)',
+    cache=True
+)
+def payable_priority(days_until_due, discount_rates, importances, days_until_discount, has_discount, out):
+    """Calculate the payment priority of each payable invoice
+
+    Args:
+        days_until_due (np.ndarray): Days until each invoice is due, negative if overdue
+        discount_rates (np.ndarray): Early payment discount rates
+        importances (np.ndarray): Supplier importance of each invoice
+        days_until_discount (np.ndarray): Days until each early payment discount expires
+        has_discount (np.ndarray): Whether an early payment discount is available
+        out (np.ndarray): Output array for the priorities
+    """
+    for i in range(days_until_due.shape[0]):
+        # Base priority based on due date
+        days = days_until_due[i]
+        if days < 0:
+            priority = 100.0  # Overdue
+        elif days < 7:
+            priority = 90.0  # Due within a week
+        elif days < 14:
+            priority = 80.0  # Due within two weeks
+        elif days < 30:
+            priority = 70.0  # Due within a month
+        else:
+            priority = 60.0  # Due later
+
+        # Expired discounts add nothing, expiring ones 20 points per percent
+        # (e.g., 2% discount = 40 points) and others 10 points per percent
+        if has_discount[i]:
+            if days_until_discount[i] < 0:
+                points = 0.0
+            elif days_until_discount[i] < 7:
+                points = 20.0
+            else:
+                points = 10.0
+            priority += points * discount_rates[i] * 100
+
+        # Adjust for supplier importance, 0-20 points
+        out[i] = priority + importances[i] * 20
+
+@njit(cache=True)
+def classify_payables(amounts, due_index, cash_balance, min_cash_buffer,
+                      has_discount, discount_rates, borrowing_rate):
+    """Classify payable invoices into working capital recommendations
+
+    Args:
+        amounts (np.ndarray): Invoice amounts
+        due_index (np.ndarray): Forecast row of each due date, NOT_IN_FORECAST if none
+        cash_balance (np.ndarray): Projected cash balance per forecast row
+        min_cash_buffer (float): Minimum cash buffer to maintain
+        has_discount (np.ndarray): Whether an early payment discount is available
+        discount_rates (np.ndarray): Early payment discount rates
+        borrowing_rate (float): Daily borrowing rate
+
+    Returns:
+        np.ndarray: PayableRecommendation of each invoice, NOT_IN_FORECAST if not classified
+    """
+    n = amounts.shape[0]
+    codes = np.empty(n, dtype=np.int64)
+
+    for k in range(n):
+        i = due_index[k]
+        amount = amounts[k]
+        if i == NOT_IN_FORECAST:
+            codes[k] = NOT_IN_FORECAST
+        elif i < cash_balance.shape[0] and cash_balance[i] < min_cash_buffer + amount:
+            # Cash might be tight, delay if possible
+            codes[k] = PayableRecommendation.DELAY
+        elif has_discount[k]:
+            # Pay early if the discount exceeds the borrowing cost, assuming 30 days
+            if amount * discount_rates[k] > amount * borrowing_rate * 30:
+                codes[k] = PayableRecommendation.PAY_EARLY
+            else:
+                codes[k] = PayableRecommendation.PAY_ON_TIME_FOR_CASH
+        else:
+            codes[k] = PayableRecommendation.PAY_ON_TIME_FOR_RELATIONSHIP
+
+    return codes
+
+@njit(cache=True)
+def classify_receivables(amounts, due_index, cash_balance, min_cash_buffer):
+    """Classify receivable invoices into working capital recommendations
+
+    Args:
+        amounts (np.ndarray): Invoice amounts
+        due_index (np.ndarray): Forecast row of each due date, NOT_IN_FORECAST if none
+        cash_balance (np.ndarray): Projected cash balance per forecast row
+        min_cash_buffer (float): Minimum cash buffer to maintain
+
+    Returns:
+        np.ndarray: ReceivableRecommendation of each invoice, NOT_IN_FORECAST if not classified
+    """
+    n = amounts.shape[0]
+    codes = np.empty(n, dtype=np.int64)
+
+    for k in range(n):
+        i = due_index[k]
+        if i == NOT_IN_FORECAST:
+            codes[k] = NOT_IN_FORECAST
+        elif i < cash_balance.shape[0] and cash_balance[i] < min_cash_buffer:
+            # Cash might be tight, accelerate collection
+            codes[k] = ReceivableRecommendation.ACCELERATE
+        elif amounts[k] > 50000:
+            codes[k] = ReceivableRecommendation.STANDARD_LARGE
+        else:
+            codes[k] = ReceivableRecommendation.STANDARD
+
+    return codes
@@ -0,0 +1,43 @@
+"""
+Prioritized Batch for Finance MCP Application
+Holds prioritized invoices as parallel arrays for the vectorized optimizer steps
+"""
+from dataclasses import dataclass, fields
+from typing import Optional
+import numpy as np
+
+@dataclass
+class PrioritizedBatch:
+    """
+    Invoices in priority order (highest first), one array per field so the
+    optimizers and kernels work on whole columns instead of per-invoice dicts
+    """
+    ids: np.ndarray  # Invoice IDs
+    counterparty_ids: np.ndarray  # Supplier or customer ID of each invoice, None if unknown
+    amounts: np.ndarray  # Invoice amounts
+    due_dates: np.ndarray  # Due dates as datetime64[D]
+    days_until_due: np.ndarray  # Days until due, negative if overdue
+    importances: np.ndarray  # Supplier or customer importance
+    priorities: np.ndarray  # Priority scores
+    has_discount: Optional[np.ndarray] = None  # Whether an early payment discount is available (AP)
+    discount_rates: Optional[np.ndarray] = None  # Early payment discount rates, 0 if none (AP)
+    discount_dates: Optional[np.ndarray] = None  # Early payment dates as datetime64[D], NaT if none (AP)
+
+    @property
+    def n(self):
+        """Number of invoices in the batch"""
+        return len(self.ids)
+
+    def take(self, indices):
+        """Select invoices by position
+
+        Args:
+            indices (np.ndarray): Positions of the invoices to keep, in their new order
+
+        Returns:
+            PrioritizedBatch: Batch of the selected invoices
+        """
+        return PrioritizedBatch(**{
+            field.name: None if getattr(self, field.name) is None else getattr(self, field.name)[indices]
+            for field in fields(self)
+        })
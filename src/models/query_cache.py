@@ -0,0 +1,56 @@
+"""
+Query Cache for Finance MCP Application
+Caches Neo4j query results reused across optimizer calls
+"""
+import logging
+import threading
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+class QueryCache:
+    """
+    Thread-safe LRU cache with a time-to-live for query results, so repeated
+    optimizer runs don't re-query data that hasn't changed
+    """
+
+    def __init__(self, maxsize=256, ttl=60):
+        """Initialize the query cache
+
+        Args:
+            maxsize (int): Maximum number of cached results
+            ttl (float): Seconds a result stays cached
+        """
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, key, load):
+        """Get a cached result, loading and caching it on a miss
+
+        Args:
+            key: Cache key
+            load (callable): Function returning the result on a miss
+
+        Returns:
+            Cached or freshly loaded result
+        """
+        with self._lock:
+            try:
+                value = self._cache[key]
+                self.hits += 1
+                return value
+            except KeyError:
+                self.misses += 1
+
+        value = load()
+        with self._lock:
+            self._cache[key] = value
+        return value
+
+    def clear(self):
+        """Drop all cached results"""
+        with self._lock:
+            self._cache.clear()
+        logger.debug("Query cache cleared")
@@ -5,10 +5,30 @@ Implements the mathematical model for integrated working capital optimization
 import logging
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from dataclasses import dataclass
+from datetime import datetime
+from operator import itemgetter
+from models.kernels import (
+    NOT_IN_FORECAST, PayableRecommendation, ReceivableRecommendation, classify_payables, classify_receivables
+)
 
 logger = logging.getLogger(__name__)
 
+@dataclass
+class InvoiceColumns:
+    """
+    Invoices sorted by due date, one sequence per field so the recommendation
+    builders resolve each invoice's dict keys once
+    """
+    ids: list  # Invoice IDs
+    amount_values: list  # Invoice amounts as stored
+    amounts: np.ndarray  # Invoice amounts as float64
+    due_date_strs: list  # Due dates as YYYY-MM-DD strings
+    due_dates: np.ndarray  # Due dates as datetime64[D]
+    has_discount: np.ndarray  # Whether an early payment discount is available
+    discount_rates: np.ndarray  # Early payment discount rates, 0 if none
+    early_payment_dates: list  # Early payment dates as YYYY-MM-DD strings, None if none
+
 class WorkingCapitalOptimizer:
     """
     Working Capital Optimization model that integrates AP and AR management
@@ -49,92 +69,104 @@ class WorkingCapitalOptimizer:
         self.objective_weights = {k: v/total for k, v in weights.items()}
         logger.info(f"Set objective weights to {self.objective_weights}")
         
-    def get_cash_flow_forecast(self):
+    def get_cash_flow_forecast(self, today=None):
         """Get the cash flow forecast for the optimization horizon
         
+        Args:
+            today (datetime.date, optional): First day of the forecast, defaults to today
+            
         Returns:
             pd.DataFrame: Cash flow forecast with dates, inflows, and outflows
         """
         # Get forecast from Neo4j
         forecast_data = self.neo4j_client.get_cash_flow_forecast(self.horizon_days)
         
-        # Convert to DataFrame
-        df = pd.DataFrame(forecast_data)
+        # Convert to DataFrame indexed by date, the database returns dates as
+        # strings or driver date objects, both of which print as YYYY-MM-DD.
+        # Flows are typed up front so an empty forecast is not object dtype.
+        dates = pd.to_datetime(pd.Index(forecast_data['date']).astype(str), format='%Y-%m-%d')
+        df = pd.DataFrame(
+            {
+                'inflow': np.asarray(forecast_data['inflow'], dtype=np.float64),
+                'outflow': np.asarray(forecast_data['outflow'], dtype=np.float64)
+            },
+            index=dates
+        )
         
         # Ensure all dates in horizon are included
-        date_range = pd.date_range(start=datetime.now().date(), periods=self.horizon_days)
-        date_df = pd.DataFrame({'date': date_range})
-        
-        # Merge with forecast data
-        result = pd.merge(date_df, df, on='date', how='left')
-        result.fillna(0, inplace=True)
+        if today is None:
+            today = datetime.now().date()
+        date_range = pd.date_range(start=today, periods=self.horizon_days)
+        result = df.reindex(date_range, fill_value=0.0).rename_axis('date').reset_index()
         
         return result
         
-    def optimize(self, scenario='base'):
+    def optimize(self, scenario='base', forecast=None, ar_invoices=None, ap_invoices=None):
         """Run the working capital optimization model
         
         Args:
             scenario (str): Scenario to optimize for (base, conservative, aggressive)
+            forecast (pd.DataFrame, optional): Cash flow forecast, fetched if not given
+            ar_invoices (list, optional): AR invoices, fetched if not given
+            ap_invoices (list, optional): AP invoices, fetched if not given
             
         Returns:
             dict: Optimization results including recommendations
         """
         logger.info(f"Running working capital optimization for scenario: {scenario}")
         
-        # Get cash flow forecast
-        forecast = self.get_cash_flow_forecast()
+        # Get cash flow forecast, fixing the date once for the whole run
+        if forecast is None:
+            today = datetime.now().date()
+            forecast = self.get_cash_flow_forecast(today)
         
         # Get AR and AP invoices
-        ar_invoices = self.neo4j_client.get_invoices_by_type('AR', self.horizon_days)
-        ap_invoices = self.neo4j_client.get_invoices_by_type('AP', self.horizon_days)
+        if ar_invoices is None:
+            ar_invoices = self.neo4j_client.get_invoices_by_type('AR', self.horizon_days)
+        if ap_invoices is None:
+            ap_invoices = self.neo4j_client.get_invoices_by_type('AP', self.horizon_days)
         
-        # Apply scenario adjustments
+        # Apply scenario adjustments, scaling a local copy of the cash buffer
+        min_buffer = self.min_cash_buffer
         if scenario == 'conservative':
             # More conservative: reduce expected AR collections, increase AP
             ar_adjustment = 0.9  # Expect only 90% of AR to be collected on time
             ap_adjustment = 1.0  # Pay all AP on time
-            self.min_cash_buffer *= 1.5  # Increase cash buffer
+            min_buffer *= 1.5  # Increase cash buffer
         elif scenario == 'aggressive':
             # More aggressive: increase expected AR collections, delay AP
             ar_adjustment = 1.0  # Expect all AR to be collected
             ap_adjustment = 0.8  # Only pay 80% of AP on time
-            self.min_cash_buffer *= 0.7  # Reduce cash buffer
+            min_buffer *= 0.7  # Reduce cash buffer
         else:  # base scenario
             ar_adjustment = 0.95
             ap_adjustment = 0.95
         
+        # Apply the adjustments to the whole forecast at once
+        inflow = forecast['inflow'].to_numpy(dtype=np.float64) * ar_adjustment
+        outflow = forecast['outflow'].to_numpy(dtype=np.float64) * ap_adjustment
+        
         # Simulate cash flow with adjustments
         initial_cash = 500000  # Example initial cash position
-        cash_balance = [initial_cash]
-        borrowing = [0]
+        net_flow = (inflow - outflow)[:-1]
         
-        for i in range(len(forecast) - 1):
-            inflow = forecast.iloc[i]['inflow'] * ar_adjustment
-            outflow = forecast.iloc[i]['outflow'] * ap_adjustment
-            
-            # Calculate new cash balance
-            new_balance = cash_balance[-1] + inflow - outflow
-            
-            # If balance falls below minimum, borrow
-            if new_balance < self.min_cash_buffer:
-                borrowed_amount = self.min_cash_buffer - new_balance
-                new_balance = self.min_cash_buffer
-                borrowing.append(borrowed_amount)
-            else:
-                borrowing.append(0)
-                
-            cash_balance.append(new_balance)
+        # Each day's balance is the previous one plus the net flow, topped up by
+        # borrowing whenever it falls below the minimum. The cumulative amount
+        # borrowed is the running maximum of the shortfall of the unborrowed balance.
+        raw_balance = initial_cash + np.cumsum(net_flow)
+        cumulative_borrowing = np.maximum.accumulate(np.maximum(min_buffer - raw_balance, 0))
+        cash_balance = np.concatenate([[initial_cash], raw_balance + cumulative_borrowing])
+        borrowing = np.concatenate([[0], np.diff(cumulative_borrowing, prepend=0)])
         
         # Calculate metrics
-        avg_cash = np.mean(cash_balance)
-        min_cash = np.min(cash_balance)
-        total_borrowing = np.sum(borrowing)
+        avg_cash = cash_balance.mean()
+        min_cash = cash_balance.min()
+        total_borrowing = borrowing.sum()
         borrowing_cost = total_borrowing * self.borrowing_rate * self.horizon_days
         
         # Generate recommendations
-        ap_recommendations = self._generate_ap_recommendations(ap_invoices, cash_balance, forecast)
-        ar_recommendations = self._generate_ar_recommendations(ar_invoices, cash_balance, forecast)
+        ap_recommendations = self._generate_ap_recommendations(ap_invoices, cash_balance, forecast, min_buffer)
+        ar_recommendations = self._generate_ar_recommendations(ar_invoices, cash_balance, forecast, min_buffer)
         
         return {
             'scenario': scenario,
@@ -149,16 +181,91 @@ class WorkingCapitalOptimizer:
                 'accounts_receivable': ar_recommendations
             },
             'cash_flow_forecast': forecast.to_dict('records'),
-            'cash_balance_projection': [{'day': i, 'balance': bal} for i, bal in enumerate(cash_balance)]
+            'cash_balance_projection': [{'day': i, 'balance': bal} for i, bal in enumerate(cash_balance.tolist())]
         }
     
-    def _generate_ap_recommendations(self, ap_invoices, cash_balance, forecast):
+    def optimize_all(self, scenarios=('base', 'conservative', 'aggressive')):
+        """Run the working capital optimization model for several scenarios
+        
+        The forecast and invoices are fetched once and shared by all scenarios.
+        
+        Args:
+            scenarios (tuple): Scenarios to optimize for
+            
+        Returns:
+            dict: Optimization results by scenario
+        """
+        today = datetime.now().date()
+        forecast = self.get_cash_flow_forecast(today)
+        ar_invoices = self.neo4j_client.get_invoices_by_type('AR', self.horizon_days)
+        ap_invoices = self.neo4j_client.get_invoices_by_type('AP', self.horizon_days)
+        
+        return {
+            scenario: self.optimize(
+                scenario, forecast=forecast, ar_invoices=ar_invoices, ap_invoices=ap_invoices
+            )
+            for scenario in scenarios
+        }
+    
+    def _forecast_rows(self, due_dates, forecast):
+        """Find the forecast row of each due date from its day offset into the forecast
+        
+        Args:
+            due_dates (np.ndarray): Due dates as datetime64[D]
+            forecast (pd.DataFrame): Cash flow forecast, one row per day of the horizon
+            
+        Returns:
+            np.ndarray: Forecast row of each due date, NOT_IN_FORECAST if outside the horizon
+        """
+        start = forecast['date'].to_numpy(dtype='datetime64[D]')[0]
+        offsets = (due_dates - start).astype(np.int64)
+        in_horizon = (offsets >= 0) & (offsets < len(forecast))
+        return np.where(in_horizon, offsets, NOT_IN_FORECAST)
+    
+    def _to_soa(self, invoices):
+        """Sort invoices by due date and split them into per-field columns
+        
+        Args:
+            invoices (list): List of invoices
+            
+        Returns:
+            InvoiceColumns: Invoice fields in due date order
+        """
+        invs = list(map(itemgetter('i'), invoices))
+        
+        # Sort by due date, keeping the parsed dates for later steps
+        due_dates = np.array([inv['dueDate'] for inv in invs], dtype='datetime64[D]')
+        order = np.argsort(due_dates, kind='stable')
+        invs = [invs[k] for k in order.tolist()]
+        
+        fields = list(map(itemgetter('id', 'amount', 'dueDate'), invs))
+        ids = [f[0] for f in fields]
+        amount_values = [f[1] for f in fields]
+        due_date_strs = [f[2] for f in fields]
+        
+        has_discount = [('earlyPaymentDate' in inv and 'discountRate' in inv) for inv in invs]
+        discount_rates = [inv['discountRate'] if has else 0.0 for inv, has in zip(invs, has_discount)]
+        early_payment_dates = [inv['earlyPaymentDate'] if has else None for inv, has in zip(invs, has_discount)]
+        
+        return InvoiceColumns(
+            ids=ids,
+            amount_values=amount_values,
+            amounts=np.array(amount_values, dtype=np.float64),
+            due_date_strs=due_date_strs,
+            due_dates=due_dates[order],
+            has_discount=np.array(has_discount, dtype=bool),
+            discount_rates=np.array(discount_rates, dtype=np.float64),
+            early_payment_dates=early_payment_dates
+        )
+    
+    def _generate_ap_recommendations(self, ap_invoices, cash_balance, forecast, min_buffer):
         """Generate recommendations for accounts payable
         
         Args:
             ap_invoices (list): List of AP invoices
-            cash_balance (list): Projected cash balance
+            cash_balance (np.ndarray): Projected cash balance
             forecast (pd.DataFrame): Cash flow forecast
+            min_buffer (float): Minimum cash buffer for the scenario
             
         Returns:
             list: Recommendations for AP management
@@ -166,76 +273,61 @@ class WorkingCapitalOptimizer:
         recommendations = []
         
         # Sort invoices by due date
-        sorted_invoices = sorted(ap_invoices, key=lambda x: x['i']['dueDate'])
+        cols = self._to_soa(ap_invoices)
         
-        for invoice in sorted_invoices:
-            inv = invoice['i']
-            due_date = inv['dueDate']
-            amount = inv['amount']
-            
-            # Find index in forecast corresponding to due date
-            due_index = forecast.index[forecast['date'] == due_date].tolist()
-            if not due_index:
+        # Look up forecast rows by due date
+        due_index = self._forecast_rows(cols.due_dates, forecast)
+        
+        # Classify all invoices at once
+        codes = classify_payables(
+            cols.amounts, due_index, cash_balance, float(min_buffer),
+            cols.has_discount, cols.discount_rates, self.borrowing_rate
+        )
+        
+        # Format the delayed payment dates (a week after due date) of all invoices at once
+        delayed_date_strs = np.datetime_as_string(cols.due_dates + 7, unit='D').tolist()
+        
+        for k, code in enumerate(codes.tolist()):
+            if code == NOT_IN_FORECAST:
                 continue
-            due_index = due_index[0]
             
-            # Check cash balance around due date
-            if due_index < len(cash_balance) and cash_balance[due_index] < self.min_cash_buffer + amount:
+            due_date = cols.due_date_strs[k]
+            recommendation = {
+                'invoice_id': cols.ids[k],
+                'amount': cols.amount_values[k],
+                'due_date': due_date
+            }
+            if code == PayableRecommendation.DELAY:
                 # Cash might be tight, recommend delay if possible
-                recommendations.append({
-                    'invoice_id': inv['id'],
-                    'amount': amount,
-                    'due_date': due_date,
-                    'action': 'delay',
-                    'reason': 'Cash flow constraint',
-                    'recommended_payment_date': (datetime.strptime(due_date, '%Y-%m-%d') + timedelta(days=7)).strftime('%Y-%m-%d')
-                })
+                recommendation['action'] = 'delay'
+                recommendation['reason'] = 'Cash flow constraint'
+                recommendation['recommended_payment_date'] = delayed_date_strs[k]
+            elif code == PayableRecommendation.PAY_EARLY:
+                # Discount benefit exceeds borrowing cost, recommend early payment
+                recommendation['action'] = 'pay_early'
+                recommendation['reason'] = 'Discount benefit exceeds financing cost'
+                recommendation['recommended_payment_date'] = cols.early_payment_dates[k]
+                recommendation['discount_amount'] = cols.amount_values[k] * cols.discount_rates[k].item()
+            elif code == PayableRecommendation.PAY_ON_TIME_FOR_CASH:
+                recommendation['action'] = 'pay_on_time'
+                recommendation['reason'] = 'Optimal cash management'
+                recommendation['recommended_payment_date'] = due_date
             else:
-                # Check if early payment discount is available
-                if 'earlyPaymentDate' in inv and 'discountRate' in inv:
-                    early_date = inv['earlyPaymentDate']
-                    discount_rate = inv['discountRate']
-                    discount_amount = amount * discount_rate
-                    
-                    # If discount benefit exceeds borrowing cost, recommend early payment
-                    if discount_amount > (amount * self.borrowing_rate * 30):  # Assuming 30 days
-                        recommendations.append({
-                            'invoice_id': inv['id'],
-                            'amount': amount,
-                            'due_date': due_date,
-                            'action': 'pay_early',
-                            'reason': 'Discount benefit exceeds financing cost',
-                            'recommended_payment_date': early_date,
-                            'discount_amount': discount_amount
-                        })
-                    else:
-                        recommendations.append({
-                            'invoice_id': inv['id'],
-                            'amount': amount,
-                            'due_date': due_date,
-                            'action': 'pay_on_time',
-                            'reason': 'Optimal cash management',
-                            'recommended_payment_date': due_date
-                        })
-                else:
-                    recommendations.append({
-                        'invoice_id': inv['id'],
-                        'amount': amount,
-                        'due_date': due_date,
-                        'action': 'pay_on_time',
-                        'reason': 'Maintain supplier relationship',
-                        'recommended_payment_date': due_date
-                    })
+                recommendation['action'] = 'pay_on_time'
+                recommendation['reason'] = 'Maintain supplier relationship'
+                recommendation['recommended_payment_date'] = due_date
+            recommendations.append(recommendation)
         
         return recommendations
     
-    def _generate_ar_recommendations(self, ar_invoices, cash_balance, forecast):
+    def _generate_ar_recommendations(self, ar_invoices, cash_balance, forecast, min_buffer):
         """Generate recommendations for accounts receivable
         
         Args:
             ar_invoices (list): List of AR invoices
-            cash_balance (list): Projected cash balance
+            cash_balance (np.ndarray): Projected cash balance
             forecast (pd.DataFrame): Cash flow forecast
+            min_buffer (float): Minimum cash buffer for the scenario
             
         Returns:
             list: Recommendations for AR management
@@ -243,24 +335,24 @@ class WorkingCapitalOptimizer:
         recommendations = []
         
         # Sort invoices by due date
-        sorted_invoices = sorted(ar_invoices, key=lambda x: x['i']['dueDate'])
+        cols = self._to_soa(ar_invoices)
         
-        for invoice in sorted_invoices:
-            inv = invoice['i']
-            due_date = inv['dueDate']
-            amount = inv['amount']
-            
-            # Find index in forecast corresponding to due date
-            due_index = forecast.index[forecast['date'] == due_date].tolist()
-            if not due_index:
+        # Look up forecast rows by due date
+        due_index = self._forecast_rows(cols.due_dates, forecast)
+        
+        # Classify all invoices at once
+        codes = classify_receivables(cols.amounts, due_index, cash_balance, float(min_buffer))
+        
+        for invoice_id, amount, due_date, code in zip(
+            cols.ids, cols.amount_values, cols.due_date_strs, codes.tolist()
+        ):
+            if code == NOT_IN_FORECAST:
                 continue
-            due_index = due_index[0]
             
-            # Check cash balance around due date
-            if due_index < len(cash_balance) and cash_balance[due_index] < self.min_cash_buffer:
+            if code == ReceivableRecommendation.ACCELERATE:
                 # Cash might be tight, recommend aggressive collection
                 recommendations.append({
-                    'invoice_id': inv['id'],
+                    'invoice_id': invoice_id,
                     'amount': amount,
                     'due_date': due_date,
                     'action': 'accelerate',
@@ -272,22 +364,24 @@ class WorkingCapitalOptimizer:
                 })
             else:
                 # Normal collection process
+                recommended_actions = [
+                    {'type': 'reminder', 'timing': '7_days_before_due', 'priority': 'normal'},
+                    {'type': 'reminder', 'timing': '1_day_after_due', 'priority': 'normal'}
+                ]
+                
+                # If invoice is large, add additional recommendation
+                if code == ReceivableRecommendation.STANDARD_LARGE:
+                    recommended_actions.append(
+                        {'type': 'call', 'timing': '3_days_after_due', 'priority': 'high'}
+                    )
+                
                 recommendations.append({
-                    'invoice_id': inv['id'],
+                    'invoice_id': invoice_id,
                     'amount': amount,
                     'due_date': due_date,
                     'action': 'standard',
                     'reason': 'Regular collection process',
-                    'recommended_actions': [
-                        {'type': 'reminder', 'timing': '7_days_before_due', 'priority': 'normal'},
-                        {'type': 'reminder', 'timing': '1_day_after_due', 'priority': 'normal'}
-                    ]
+                    'recommended_actions': recommended_actions
                 })
-                
-                # If invoice is large, add additional recommendation
-                if amount > 50000:
-                    recommendations[-1]['recommended_actions'].append(
-                        {'type': 'call', 'timing': '3_days_after_due', 'priority': 'high'}
-                    )
         
         return recommendations
@@ -3,17 +3,26 @@ Data Utilities for Finance MCP Application
 Helper functions for data manipulation and initialization
 """
 import logging
-import random
-from datetime import datetime, timedelta
+import numpy as np
+from datetime import datetime
+from neo4j import RoutingControl
 from database.neo4j_client import Neo4jClient
 
 logger = logging.getLogger(__name__)
 
-def generate_sample_data(neo4j_client: Neo4jClient):
+# Number of invoices written per bulk transaction
+INVOICE_BATCH_SIZE = 5000
+
+# Number of sample invoices to generate
+NUM_AR_INVOICES = 20
+NUM_AP_INVOICES = 15
+
+def generate_sample_data(neo4j_client: Neo4jClient, seed=None):
     """Generate sample data for the finance application
     
     Args:
         neo4j_client: Neo4j client instance
+        seed: Optional random seed for reproducible sample data
     """
     logger.info("Generating sample data")
     
@@ -36,78 +45,89 @@ def generate_sample_data(neo4j_client: Neo4jClient):
     ]
     
     # Create customers in Neo4j
-    for customer in customers:
-        query = """
-        CREATE (c:Customer {
-            id: $id,
-            name: $name,
-            credit_score: $credit_score
-        })
-        RETURN c
-        """
-        neo4j_client.run_query(query, customer)
+    query = """
+    UNWIND $rows AS r
+    CREATE (c:Customer {
+        id: r.id,
+        name: r.name,
+        credit_score: r.credit_score
+    })
+    """
+    neo4j_client.run_query(query, {"rows": customers}, routing=RoutingControl.WRITE)
     
     # Create suppliers in Neo4j
-    for supplier in suppliers:
-        query = """
-        CREATE (s:Supplier {
-            id: $id,
-            name: $name,
-            reliability: $reliability
-        })
-        RETURN s
-        """
-        neo4j_client.run_query(query, supplier)
-    
-    # Generate sample AR invoices
-    today = datetime.now().date()
-    
-    for i in range(20):
-        customer = random.choice(customers)
-        amount = random.uniform(5000, 50000)
-        issue_date = today - timedelta(days=random.randint(0, 60))
-        due_date = issue_date + timedelta(days=30)  # 30-day terms
-        
-        invoice_data = {
+    query = """
+    UNWIND $rows AS r
+    CREATE (s:Supplier {
+        id: r.id,
+        name: r.name,
+        reliability: r.reliability
+    })
+    """
+    neo4j_client.run_query(query, {"rows": suppliers}, routing=RoutingControl.WRITE)
+    
+    rng = np.random.default_rng(seed)
+    today = np.datetime64(datetime.now().date(), 'D')
+    
+    # Generate sample AR invoices, drawing all random values at once
+    ar_amounts = np.round(rng.uniform(5000, 50000, NUM_AR_INVOICES), 2).tolist()
+    ar_customers = rng.integers(0, len(customers), NUM_AR_INVOICES).tolist()
+    ar_issue_dates = today - rng.integers(0, 61, NUM_AR_INVOICES)
+    ar_due_dates = ar_issue_dates + 30  # 30-day terms
+    
+    invoices = [
+        {
             "id": f"AR{i+1:04d}",
-            "amount": round(amount, 2),
-            "issueDate": issue_date.strftime('%Y-%m-%d'),
-            "dueDate": due_date.strftime('%Y-%m-%d'),
+            "amount": amount,
+            "issueDate": issue_date,
+            "dueDate": due_date,
             "type": "AR",
-            "entityId": customer["id"]
+            "entityId": customers[customer]["id"]
         }
-        
-        neo4j_client.create_invoice(invoice_data)
+        for i, (amount, customer, issue_date, due_date) in enumerate(zip(
+            ar_amounts,
+            ar_customers,
+            np.datetime_as_string(ar_issue_dates, unit='D').tolist(),
+            np.datetime_as_string(ar_due_dates, unit='D').tolist()
+        ))
+    ]
     
     # Generate sample AP invoices
-    for i in range(15):
-        supplier = random.choice(suppliers)
-        amount = random.uniform(3000, 40000)
-        issue_date = today - timedelta(days=random.randint(0, 45))
-        due_date = issue_date + timedelta(days=45)  # 45-day terms
-        
-        # Add early payment discount to some invoices
-        if random.random() < 0.3:
-            early_payment_date = issue_date + timedelta(days=10)
-            discount_rate = 0.02  # 2% discount
-        else:
-            early_payment_date = None
-            discount_rate = None
-        
+    ap_amounts = np.round(rng.uniform(3000, 40000, NUM_AP_INVOICES), 2).tolist()
+    ap_suppliers = rng.integers(0, len(suppliers), NUM_AP_INVOICES).tolist()
+    ap_issue_dates = today - rng.integers(0, 46, NUM_AP_INVOICES)
+    ap_due_dates = ap_issue_dates + 45  # 45-day terms
+    
+    # Add early payment discount to some invoices
+    ap_has_discount = (rng.random(NUM_AP_INVOICES) < 0.3).tolist()
+    ap_early_payment_dates = ap_issue_dates + 10
+    discount_rate = 0.02  # 2% discount
+    
+    for i, (amount, supplier, issue_date, due_date, has_discount, early_payment_date) in enumerate(zip(
+        ap_amounts,
+        ap_suppliers,
+        np.datetime_as_string(ap_issue_dates, unit='D').tolist(),
+        np.datetime_as_string(ap_due_dates, unit='D').tolist(),
+        ap_has_discount,
+        np.datetime_as_string(ap_early_payment_dates, unit='D').tolist()
+    )):
         invoice_data = {
             "id": f"AP{i+1:04d}",
-            "amount": round(amount, 2),
-            "issueDate": issue_date.strftime('%Y-%m-%d'),
-            "dueDate": due_date.strftime('%Y-%m-%d'),
+            "amount": amount,
+            "issueDate": issue_date,
+            "dueDate": due_date,
             "type": "AP",
-            "entityId": supplier["id"]
+            "entityId": suppliers[supplier]["id"]
         }
         
-        if early_payment_date:
-            invoice_data["earlyPaymentDate"] = early_payment_date.strftime('%Y-%m-%d')
+        if has_discount:
+            invoice_data["earlyPaymentDate"] = early_payment_date
             invoice_data["discountRate"] = discount_rate
         
-        neo4j_client.create_invoice(invoice_data)
+        invoices.append(invoice_data)
+    
+    for start in range(0, len(invoices), INVOICE_BATCH_SIZE):
+        neo4j_client.create_invoices_bulk(invoices[start:start + INVOICE_BATCH_SIZE])
     
     logger.info("Sample data generation complete")
 
@@ -124,7 +144,7 @@ def clear_database(neo4j_client: Neo4jClient):
     DETACH DELETE n
     """
     
-    neo4j_client.run_query(query)
+    neo4j_client.run_query(query, routing=RoutingControl.WRITE)
     
     logger.info("Database cleared")
 
@@ -142,12 +162,12 @@ def init_database(neo4j_client: Neo4jClient, reset=False):
     if reset:
         clear_database(neo4j_client)
     
-    # Check if database already has data
-    query = "MATCH (n) RETURN count(n) as count"
+    # Check if database already has data, stopping at the first node found
+    query = "MATCH (n) RETURN 1 LIMIT 1"
     result = neo4j_client.run_query(query)
     
-    if result[0]["count"] == 0:
+    if not result:
         # Generate sample data
         generate_sample_data(neo4j_client)
     else:
-        logger.info(f"Database already contains {result[0]['count']} nodes. Skipping data generation.")
+        logger.info("Database already contains data. Skipping data generation.")
@@ -0,0 +1,32 @@
+"""
+Kernel Tests for Finance MCP Application
+Checks the numerical kernels against their straightforward definitions
+"""
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from models.kernels import priority_order
+
+class PriorityOrderTest(unittest.TestCase):
+    """priority_order with top_k must be a prefix of the full order"""
+
+    def test_top_k_is_prefix_with_ties(self):
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            n = int(rng.integers(1, 60))
+            # Bucketed priorities, so ties are common as in the optimizers
+            priorities = rng.integers(0, 6, n).astype(np.float64) * 10
+            full = priority_order(priorities)
+            for k in range(n + 2):
+                np.testing.assert_array_equal(priority_order(priorities, k), full[:k])
+
+    def test_full_order_is_stable(self):
+        priorities = np.array([110.0, 90.0, 110.0, 120.0, 90.0])
+        np.testing.assert_array_equal(priority_order(priorities), [3, 0, 2, 1, 4])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+MCP Round Trip Tests for Finance MCP Application
+Sends client-built messages through the registered server handlers
+"""
+import os
+import sys
+import unittest
+from contextlib import asynccontextmanager
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from api import mcp_handlers
+from api.mcp_messages import MSGPACK_CONTENT_TYPE, JSON_CONTENT_TYPE
+from google_agent_integration import GoogleAgentMCPIntegration, MCPError
+
+class _Router:
+    """Router that records handlers by message type"""
+
+    def __init__(self):
+        self.handlers = {}
+
+    def register_handler(self, message_type, handler):
+        self.handlers[message_type] = handler
+
+class _Client:
+    """MCP client that dispatches messages to the router in process"""
+
+    def __init__(self, router):
+        self.router = router
+
+    async def send_message(self, message):
+        handler = self.router.handlers[message["type"]]
+        result = handler(message)
+        return await result if hasattr(result, "__await__") else result
+
+class _Pool:
+    """Session pool handing out in-process clients"""
+
+    def __init__(self, router):
+        self.client = _Client(router)
+
+    @asynccontextmanager
+    async def acquire(self, host, port):
+        yield self.client
+
+class _Neo4jClient:
+    uri = "bolt://localhost:7687"
+    user = "neo4j"
+    password = "password"
+
+    def get_cash_flow_forecast(self, days_horizon=90):
+        return {"date": ["2026-01-01"], "inflow": [10.0], "outflow": [float(days_horizon)]}
+
+class _WorkingCapitalOptimizer:
+    neo4j_client = _Neo4jClient()
+
+    def optimize(self, scenario="base"):
+        return {"scenario": scenario, "metrics": {"total_borrowing": 0.0}}
+
+class _AccountsPayableOptimizer:
+    def optimize_payment_schedule(self, cash_position):
+        return {"metrics": {"cash_position": cash_position}}
+
+class _AccountsReceivableOptimizer:
+    def optimize_collection_strategy(self, cash_position, objective="balanced"):
+        return {"metrics": {"cash_position": cash_position, "objective": objective}}
+
+class MCPRoundTripTest(unittest.IsolatedAsyncioTestCase):
+    """Client messages must be understood by the server handlers"""
+
+    def setUp(self):
+        router = _Router()
+        with mock.patch.object(mcp_handlers, "Neo4jCypherHandler"):
+            mcp_handlers.register_mcp_handlers(
+                router,
+                _WorkingCapitalOptimizer(),
+                _AccountsPayableOptimizer(),
+                _AccountsReceivableOptimizer(),
+                invoice_batcher=None
+            )
+        self.integration = GoogleAgentMCPIntegration("localhost", 9000, pool=_Pool(router))
+
+    async def test_negotiates_msgpack(self):
+        await self.integration.connect()
+        self.assertEqual(self.integration.content_type, MSGPACK_CONTENT_TYPE)
+
+    async def test_call(self):
+        for content_type in (MSGPACK_CONTENT_TYPE, JSON_CONTENT_TYPE):
+            with self.subTest(content_type=content_type):
+                self.integration.content_type = content_type
+                result = await self.integration.optimize_working_capital(scenario="aggressive")
+                self.assertEqual(result["scenario"], "aggressive")
+
+                result = await self.integration.optimize_accounts_receivable(1000.0, objective="cash_flow")
+                self.assertEqual(result["metrics"], {"cash_position": 1000.0, "objective": "cash_flow"})
+
+    async def test_batch(self):
+        for content_type in (MSGPACK_CONTENT_TYPE, JSON_CONTENT_TYPE):
+            with self.subTest(content_type=content_type):
+                self.integration.content_type = content_type
+                forecast, wc_result, unknown = await self.integration.batch([
+                    {"type": "finance.cash_flow.forecast", "payload": {"days_horizon": 30}},
+                    {"type": "finance.working_capital.optimize", "payload": {"scenario": "conservative"}},
+                    {"type": "finance.unknown", "payload": {}}
+                ])
+                self.assertEqual(forecast["outflow"], [30.0])
+                self.assertEqual(wc_result["scenario"], "conservative")
+                self.assertIsInstance(unknown, MCPError)
+
+if __name__ == "__main__":
+    unittest.main()